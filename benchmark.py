@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import getopt, json, math, multiprocessing, os, shutil, subprocess, sys, tempfile, time
+import numpy as np
+import flightrecorder24tofdr as tofdr
+
+script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'flightrecorder24tofdr.py')
+heavy_modules = ['scipy', 'matplotlib']
+
+# Command line of each mode whose startup is measured (LOG and OUTPUT are replaced by the paths of the run)
+import_modes = [
+	('help', ['--help']),
+	('convert', ['--no-cache', '-i', 'LOG', '-o', 'OUTPUT']),
+	('info', ['--no-cache', '--info', '-i', 'LOG', '-o', 'OUTPUT']),
+	('info-only', ['--no-cache', '--info-only', '-i', 'LOG']),
+	('smooth', ['--no-cache', '-s', '2', '-i', 'LOG', '-o', 'OUTPUT']),
+	('plot', ['--no-cache', '-p', '-i', 'LOG', '-o', 'OUTPUT']),
+]
+
+# Run the script in the child process and report the heavy modules it imported
+child_code = '''
+import json, runpy, sys
+sys.argv = sys.argv[1:]
+try:
+	runpy.run_path(sys.argv[0], run_name="__main__")
+except SystemExit:
+	pass
+sys.stdout.flush()
+sys.stderr.write("BENCHMARK " + json.dumps([m for m in %r if m in sys.modules]) + "\\n")
+''' % heavy_modules
+
+#####
+# Synthetic FlightRecorder24 logs: a flight going around in circles with a climb, a cruise and a
+# descent, sampled every 20ms with noise, text values (NaN, n/a) and garbage lines like the real logs
+log_header = ['version;date;time;location;x;pilot;aircraft;registration', '1.2.4;24/04/2016;10:50;LFMD Cannes;x;John Doe;DR400;F-GABC', 'timedate;time;lat;lon;h msl;speed;bearing;accuracy;nx;ny;nz;pitch;roll;yaw;original pitch;original roll;original yaw;pressure;baro;phase;event']
+log_start_time = 1461487808295 # Epoch time (milliseconds) of the first line
+log_period = 20 # Milliseconds between two lines
+log_block_size = 100000 # Number of lines generated at once
+garbage_lines = ['', 'GPS signal lost', 'UTC 24-Apr-2016;;;;', ';;;;;;;;;;;;;;;;;;;;', 'timedate;time;lat;lon']
+
+def flight_profile(indices, nb_rows, random):
+	# Altitude (feet) and speed (knots) of the climb, cruise and descent phases, heading turning slowly
+	phase = indices / float(max(nb_rows - 1, 1))
+	alt = 30.0 + 5500.0 * np.clip(np.minimum(phase / 0.2, (1.0 - phase) / 0.2), 0.0, 1.0) + random.normal(0.0, 3.0, len(indices))
+	speed = 100.0 * np.clip(np.minimum(phase / 0.05, (1.0 - phase) / 0.05), 0.1, 1.0)
+	yaw = np.mod(350.0 + indices * 0.002 + random.normal(0.0, 0.3, len(indices)), 360.0)
+	pitch = 8.0 * (phase < 0.2) - 4.0 * (phase > 0.8) + random.normal(0.0, 1.0, len(indices))
+	roll = 10.0 * np.sin(indices / 3000.0) + random.normal(0.0, 2.0, len(indices))
+	return alt, speed, yaw, pitch, roll
+
+def write_log(log_file, nb_rows, seed=1):
+	random = np.random.RandomState(seed)
+	f = open(log_file, 'w')
+	f.write('\n'.join(log_header) + '\n')
+	lat, lon = 43.55, 6.95
+	timedates = {}
+	for first in range(0, nb_rows, log_block_size):
+		indices = np.arange(first, min(first + log_block_size, nb_rows))
+		alt, speed, yaw, pitch, roll = flight_profile(indices, nb_rows, random)
+		step = speed * 0.514444 * log_period / 1000.0 / 6371000.0 * 180.0 / math.pi # degrees
+		lats = lat + np.cumsum(step * np.cos(np.radians(yaw)))
+		lons = lon + np.cumsum(step * np.sin(np.radians(yaw)) / np.cos(np.radians(lats)))
+		lat, lon = lats[-1], lons[-1]
+		values = random.random_sample(len(indices))
+		lines = []
+		for i, t in enumerate((log_start_time + indices * log_period).tolist()):
+			second = t // 1000
+			if second not in timedates:
+				timedates = {second: time.strftime('UTC %d-%b-%Y %H:%M:%S', time.gmtime(second))}
+			line = '%s.%03d;%d;%.7f;%.7f;%.1f;%.1f;%.0f;5;0.1;0.2;9.8;%.3f;%.3f;%.3f;0;0;0;1013;0;1;0' % (timedates[second], t % 1000, t, lats[i], lons[i], alt[i], speed[i] * 0.514444, yaw[i], pitch[i], roll[i], yaw[i])
+			if values[i] < 0.0005:
+				line = garbage_lines[int(values[i] * 10000)]
+			elif values[i] < 0.001:
+				line = line.replace(';%.3f;' % roll[i], ';NaN;', 1)
+			elif values[i] < 0.0015:
+				line = line.replace(';%.7f;' % lats[i], ';n/a;', 1)
+			lines.append(line + '\n')
+		f.writelines(lines)
+	f.close()
+
+def log_path(data_dir, nb_rows):
+	# Generated logs are kept in data_dir and reused by the next runs
+	log_file = os.path.join(data_dir, 'flight_%d.csv' % nb_rows)
+	if not os.path.isfile(log_file):
+		start = time.time()
+		write_log(log_file + '.tmp', nb_rows)
+		os.rename(log_file + '.tmp', log_file)
+		print "generated %s in %.1f s" % (log_file, time.time() - start)
+	return log_file
+
+#####
+# Import time
+def run_mode(args, log_file, output):
+	args = [log_file if arg == 'LOG' else output if arg == 'OUTPUT' else arg for arg in args]
+	start = time.time()
+	process = subprocess.Popen([sys.executable, '-c', child_code, script] + args, stdout=open(os.devnull, 'w'), stderr=subprocess.PIPE)
+	errors = process.communicate()[1]
+	wall_time = time.time() - start
+	modules = [json.loads(line[len('BENCHMARK '):]) for line in errors.splitlines() if line.startswith('BENCHMARK ')]
+	if process.returncode or not modules:
+		raise RuntimeError("run of " + ' '.join(args) + " failed:\n" + errors)
+	return wall_time, modules[0]
+
+def benchmark_imports(repeat, work_dir):
+	log_file = os.path.join(work_dir, 'startup.csv')
+	write_log(log_file, 100)
+	results = []
+	for name, args in import_modes:
+		times = []
+		for i in range(repeat):
+			wall_time, modules = run_mode(args, log_file, os.path.join(work_dir, name, 'flight'))
+			times.append(wall_time)
+		results.append({'benchmark': 'startup', 'mode': name, 'args': ' '.join(args), 'repeat': repeat, 'min_time': min(times), 'max_time': max(times), 'heavy_modules': modules})
+		print "%-10s %8.3f s  %s" % (name, min(times), ', '.join(modules) if modules else '-')
+	return results
+
+#####
+# Stages of the conversion
+def plot_figures(smoothed_data, fdr_data, output):
+	plotter = tofdr.FigurePlotter()
+	plotter.plot(tofdr.prepare_figures(smoothed_data, 'Time;Lon;Lat;Alt;Roll;Pitch;Yaw', 'r', output, '_smooth'))
+	plotter.plot(tofdr.prepare_figures(fdr_data, tofdr.fdr_format, 'royalblue', output, '_fdr'))
+	plotter.close()
+
+def run_stages(log_file, sigma, window, plotting, output, queue):
+	# Same stages as convert, each one timed separately
+	options = tofdr.ConvertOptions()
+	stages = []
+	def stage(name, function, *args):
+		tofdr.reset_peak_memory()
+		wall_start, cpu_start = time.time(), tofdr.cpu_time()
+		value = function(*args)
+		stages.append({'stage': name, 'wall_time': time.time() - wall_start, 'cpu_time': tofdr.cpu_time() - cpu_start, 'peak_memory_mb': tofdr.peak_memory()})
+		return value
+
+	raw_data, ff = stage('format_and_filter_csv', tofdr.format_and_filter_csv, log_file, options.start_time, options.stop_time, None)
+	fixed_data = stage('fix_raw_data', tofdr.fix_raw_data, raw_data, options.fix_param)
+	smoothed_data = stage('smooth_data', tofdr.smooth_data, fixed_data, sigma, window)
+	fdr_data = stage('to_fdr', tofdr.to_fdr, smoothed_data, sigma, window)
+	stage('write_kml', tofdr.write_kml, smoothed_data, tofdr.output_filename(output, '', '.kml'))
+	stage('write_fdr', tofdr.write_fdr, fdr_data, ff, tofdr.output_filename(output, '', '.fdr'))
+	if plotting:
+		stage('plot_figures', plot_figures, smoothed_data, fdr_data, output)
+	queue.put((len(raw_data), stages))
+
+def benchmark_pipeline(sizes, sigma, window, plotting, data_dir, work_dir):
+	results = []
+	for nb_rows in sizes:
+		log_file = log_path(data_dir, nb_rows)
+		output = os.path.join(work_dir, 'flight_%d' % nb_rows)
+		os.makedirs(output)
+		# Each size is measured in a new process so that its memory doesn't depend on the previous ones
+		queue = multiprocessing.Queue()
+		process = multiprocessing.Process(target=run_stages, args=(log_file, sigma, window, plotting, output, queue))
+		process.start()
+		process.join()
+		if process.exitcode:
+			raise RuntimeError("conversion of " + log_file + " failed")
+		nb_valid_rows, stages = queue.get()
+		shutil.rmtree(output)
+		total_time = sum(stage['wall_time'] for stage in stages)
+		results.append({'benchmark': 'pipeline', 'rows': nb_rows, 'valid_rows': nb_valid_rows, 'file_size': os.path.getsize(log_file), 'sigma': sigma, 'window': window, 'stages': stages, 'total_time': total_time})
+		print "%d rows (%d valid, %.1f MB)" % (nb_rows, nb_valid_rows, os.path.getsize(log_file) / 1048576.0)
+		for stage in stages:
+			print "    %-22s %8.3f s %8.3f s cpu %8.1f MB" % (stage['stage'], stage['wall_time'], stage['cpu_time'], stage['peak_memory_mb'])
+		print "    %-22s %8.3f s (%.0f rows/s)" % ('total', total_time, nb_rows / total_time)
+	return results
+
+#####
+# Main
+def usage():
+	print "Usage:"
+	print "    benchmark.py [-h] [-b startup,pipeline] [-r N] [-n 10000,100000] [-s 2] [-w 0] [-d data/] [-o report.json]"
+	print "    -h, --help"
+	print "        Print this help"
+	print "    -b LIST, --benchmark=LIST"
+	print "        Comma separated list of the benchmarks to run: startup (time to start the script"
+	print "        in each mode), pipeline (time and peak memory of each stage of the conversion)"
+	print "    -r N, --repeat=N"
+	print "        Number of runs of each startup measure (the minimum time is reported)"
+	print "    -n LIST, --rows=LIST"
+	print "        Comma separated list of the numbers of lines of the logs converted by the"
+	print "        pipeline benchmark"
+	print "    -s VAL, --sigma=VAL"
+	print "        Sigma value used to smooth the data in the pipeline benchmark"
+	print "    -w SIZE, --window=SIZE"
+	print "        Smooth the data with a moving average of SIZE rows instead of the gaussian filter"
+	print "    --no-plot"
+	print "        Don't time the generation of the figures in the pipeline benchmark"
+	print "    -d DIR, --data-dir=DIR"
+	print "        Keep the generated logs in DIR to reuse them in the next runs"
+	print "    -o FILE, --output=FILE"
+	print "        Write the results as json to FILE"
+
+def main(argv):
+	benchmarks = ['startup', 'pipeline']
+	repeat = 5
+	sizes = [10000, 100000, 1000000]
+	sigma = 2.0
+	window = 0
+	plotting = True
+	data_dir = ""
+	output = ""
+	try:
+		opts, args = getopt.getopt(argv, "hb:r:n:s:w:d:o:", ["help", "benchmark=", "repeat=", "rows=", "sigma=", "window=", "no-plot", "data-dir=", "output="])
+	except getopt.GetoptError:
+		usage()
+		sys.exit(2)
+	for opt, arg in opts:
+		if opt in ("-h", "--help"):
+			usage()
+			sys.exit()
+		elif opt in ("-b", "--benchmark"):
+			benchmarks = arg.split(',')
+		elif opt in ("-r", "--repeat"):
+			repeat = int(arg)
+		elif opt in ("-n", "--rows"):
+			sizes = [int(size) for size in arg.split(',')]
+		elif opt in ("-s", "--sigma"):
+			sigma = float(arg)
+		elif opt in ("-w", "--window"):
+			window = int(arg)
+		elif opt in ("--no-plot"):
+			plotting = False
+		elif opt in ("-d", "--data-dir"):
+			data_dir = arg
+		elif opt in ("-o", "--output"):
+			output = arg
+
+	work_dir = tempfile.mkdtemp(prefix='tofdr-benchmark-')
+	if data_dir and not os.path.isdir(data_dir):
+		os.makedirs(data_dir)
+	results = []
+	try:
+		if 'startup' in benchmarks:
+			results += benchmark_imports(repeat, work_dir)
+		if 'pipeline' in benchmarks:
+			results += benchmark_pipeline(sizes, sigma, window, plotting, data_dir or work_dir, work_dir)
+	finally:
+		shutil.rmtree(work_dir)
+
+	report = {'python': sys.version.split()[0], 'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'results': results}
+	if output:
+		f = open(output, 'w')
+		json.dump(report, f, indent=2, sort_keys=True)
+		f.close()
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
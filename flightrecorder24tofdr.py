@@ -1,22 +1,39 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import csv
+import bz2, calendar, collections, contextlib, cPickle, cStringIO, csv, gzip, hashlib
 
+import functools, itertools, operator
 import math
 import numpy as np
-from scipy.ndimage import gaussian_filter1d
-import matplotlib.pyplot as plot
+# scipy and matplotlib are only imported by the functions smoothing and plotting data (slow to import)
 
-import getopt, os, sys
+import getopt, glob, json, multiprocessing, os, shutil, signal, sys, tempfile, traceback
 import time
+from xml.etree import cElementTree as ElementTree
+from xml.sax.saxutils import escape
 
 time_factor = 1000.0 # Data in input format is epoch in milliseconds (so * 1000 compored to standard unix epoch)
+chunk_size = 65536 # Number of csv lines converted to numbers at once
+seek_precision = 16384 # Size (bytes) of the part of the csv file read before the start time
 
-# Input format of csv file from Flight Recorder 24
-fields_srcs = ['timedate', 'time', 'lat', 'lon', 'h msl', 'speed', 'bearing', 'accuracy', 'nx', 'ny', 'nz', 'pitch', 'roll', 'yaw', 'original pitch', 'original roll', 'original yaw', 'pressure', 'baro', 'phase', 'event']
+# Fields of the rows of the csv file from Flight Recorder 24 (see flightrecorder24_layout)
+flightrecorder24_fields = ['timedate', 'time', 'lat', 'lon', 'h msl', 'speed', 'bearing', 'accuracy', 'nx', 'ny', 'nz', 'pitch', 'roll', 'yaw', 'original pitch', 'original roll', 'original yaw', 'pressure', 'baro', 'phase', 'event']
 
+# Columns of the data given by all the input readers (time is epoch in milliseconds, h msl in feet)
 fields_dest = ['time', 'lon', 'lat', 'h msl', 'roll', 'pitch', 'yaw']
+info_fields = fields_dest[:3] # Only fields needed by the summary of a flight (--info-only)
+raw_angle_columns = [6] # Columns of fields_dest in degrees modulo 360 (yaw)
+# Columns of FDR data (Distance is the length of the path from the first row, in meters)
+fdr_fields = ['Time', 'Lon', 'Lat', 'Alt', 'Speed', 'Bearing', 'Pitch', 'Roll', 'Distance']
+fdr_format = ';'.join(fdr_fields)
+
+# Format of a DATA line of the FDR file: time, lon, lat, alt, aileron, elevator, pitch, roll, heading, speed
+# and a constant tail for the values which are not computed from the flight
+fdr_data_format = 'DATA,%.3f,25,%.6f,%.6f,%d, 0,%.2f,%.2f,0,%.2f,%.2f,%.2f,%.2f,0,0,0,0.5,20,0, 0,0,0,0,0,0,0,0,0, 11010,10930,4,4,90, 270,0,0,10,10,1,1,10,10,0,0,0,0,10,10, 0,0,0,0,0,0,0,0,0,0,500, 29.92,0,0,0,0,0,0, 1,1,0,0, 2000,2000,0,0, 2000,2000,0,0, 30,30,0,0, 100,100,0,0, 100,100,0,0, 0,0,0,0, 0,0,0,0, 1500,1500,0,0, 400,400,0,0, 1000,1000,0,0, 1000,1000,0,0, 0,0,0,0,\n'
+fdr_block_size = 4096 # Number of DATA lines formatted and written at once
+plot_resolution = 2000 # Number of buckets of points drawn in figures (more than the width in pixels)
+default_flight_name = 'flight' # Name of the flights read from or written to file objects without a name
 
 # Default format of a complete FDR file
 #fields_dest = ['time', 'temp', 'lon', 'lat', 'h msl', 'h rad', 'ailn', 'elev', 'rudd', 'pitch', 'roll', 'heading', 'speed', 'VVI', 'slip', 'turn', 'mach', 'AOA', 'stall', 'flap request', 'flap actual', 'slat', 'sbrk', 'gear', 'Ngear', 'Lgear', 'Rgear', 'elev trim', 'NAV–1 frq', 'NAV–2 frq', 'NAV–1 type', 'NAV–2 type', 'OBS–1', 'OBS–2', 'DME–1', 'DME–2', 'NAV–1 h-def', 'NAV–2 h-def', 'NAV–1 n/t/f', 'NAV–2 n/t/f', 'NAV–1 v-def', 'NAV–2 v-def', 'OM', 'MM', 'IM', 'f-dir 0/1', 'f-dir pitch', 'f-dir roll', 'ktmac 0/1', 'throt mode', 'hdg mode', 'alt mode', 'hnav mode', 'glslp mode', 'speed selec', 'hdg selec', 'vvi selec', 'alt selec', 'baro', 'DH', 'Mcaut 0/1', 'Mwarn 0/1', 'GPWS 0/1', 'Mmode 0–4', 'Mrang 0–6', 'throt ratio', 'prop cntrl', 'prop rpm', 'prop deg', 'N1 %', 'N2 %', 'MPR', 'EPR', 'torq', 'FF', 'ITT', 'EGT', 'CHT']
@@ -27,12 +44,40 @@ class FlightFeature:
 	time = ''
 	location = ''
 	pilot = ''
-	aircrat = ''
+	aircraft = ''
 	registration = ''
 	
 	def __str__(self):
 		return "Aircraft: %s (%s)\nPilot: %s\nLocation: %s\nDate: %s Time: UTC %s" % (self.aircraft, self.registration, self.pilot, self.location, self.date, self.time)
 
+# Column mapping of a csv logger: fields of its rows, field of each column of fields_dest (when named
+# differently), function reading the header_lines lines of the file and optionally the field of the text date
+# of the rows with the function parsing it into the date and time of FlightFeature (the date of the
+# flight is found from the epoch time of its first row without them)
+class CsvLayout:
+	def __init__(self, name, fields, columns, separator, read_header, date_field=None, parse_date=None, header_lines=3):
+		self.name = name
+		self.fields = fields
+		self.columns = columns
+		self.separator = separator
+		self.read_header = read_header
+		self.header_lines = header_lines
+		self.date_field = date_field
+		self.parse_date = parse_date
+
+	def src_column(self, field):
+		return self.fields.index(self.columns.get(field, field))
+
+# Input reader: read_chunks(input_file, start_time, stop_time, flight_feature, fields) gives the rows between
+# start_time and stop_time by chunks with the fields columns (of fields_dest) and sets flight_feature
+class InputReader:
+	def __init__(self, name, extensions, read_chunks, cached=True, layout=None):
+		self.name = name
+		self.extensions = extensions # Extensions of the files read (without the compression extension)
+		self.read_chunks = read_chunks
+		self.cached = cached # Parsed data worth keeping in the cache
+		self.layout = layout # CsvLayout of the readers of csv logs, which can be read incrementally
+
 class FixData:
 	airport_elevation = 0.0
 	elevation = 0.0
@@ -75,332 +120,1377 @@ class FixData:
 	def __str__(self):
 		return "Airport Elevation: %s\nElevation: %s\nPitch: %s\nRoll: %s\nYaw: %s\n" % (self.airport_elevation, self.elevation, self.pitch, self.roll, self.yaw)
 
+# Options of the conversion of one flight (set from the command line parameters)
+class ConvertOptions:
+	debug = False
+	info = False
+	cache = True # Use the cache of parsed flights
+	cache_size = 1024 # Maximum size of the cache (MB)
+	kml_tolerance = 0.0
+	kml_track = False
+	plotting = False
+	plot_pdf = False # All the figures in a single pdf file
+	sigma = 0
+	stream = False
+	window = 0
+	rate = 0 # Rows per second of the FDR data (0 to keep the times of the input file)
+	fdr_distance = 0.0 # Meters of the path between two rows of the FDR data (0 to keep all the rows)
+	start_time = 0
+	stop_time = float('inf') # Not the current time, which would be frozen in a long-lived process
+	stats = False # Print the time, rows and memory of each stage
+	stats_json = False # Write the statistics of the stages to a json file
+	profile = False # Run the conversion under cProfile and write the profile to a file
+	info_only = False # Only print the summary of the flight, without conversion
+	reader = None # Name of the input reader (found from the extension of the input file if None)
+	binary = False # Write the parsed data in the native binary format
+	incremental = False # Only convert the rows appended since the previous conversion
+	split = False # Convert each flight of the log separately
+	split_gap = 300.0 # Seconds without rows between two flights
+	ground_speed = 30.0 # Ground speed (knots) under which the aircraft is on the ground if its altitude is steady
+	summary_format = 'text' # Format of the summaries of --info-only: text, json or csv
+
+	def __init__(self):
+		self.fix_param = FixData()
+		self.cache_dir = default_cache_dir()
+
 #####
 # Utilities functions and to make some computations
+def open_output(output_file):
+	# Outputs are written to a file name or to a file object of the caller (which is left open)
+	if isinstance(output_file, basestring):
+		return open(output_file, 'wb'), True
+	return output_file, False
+
 def eprint(*args):
 	sys.stderr.write(*args)
 	sys.stderr.write('\n')
 
+# Points can also be arrays of values by field (e.g. data[:-1].T and data[1:].T) to get all distances at once
 def great_circle(pointA, pointB):
-	lon1 = math.radians(pointA[1])
-	lat1 = math.radians(pointA[2])
-	lon2 = math.radians(pointB[1])
-	lat2 = math.radians(pointB[2])
+	lon1 = np.radians(pointA[1])
+	lat1 = np.radians(pointA[2])
+	lon2 = np.radians(pointB[1])
+	lat2 = np.radians(pointB[2])
 	R = 6371000
-	x2 = (lon2 - lon1) * math.cos(0.5 * (lat2 + lat1))
+	x2 = (lon2 - lon1) * np.cos(0.5 * (lat2 + lat1))
 	y2 = lat2 - lat1
-	d = R * math.sqrt(x2 * x2 + y2 * y2)
+	d = R * np.sqrt(x2 * x2 + y2 * y2)
 	return d
 
+def bearing(pointA, pointB):
+	# Initial great circle course (degrees from north) from pointA to pointB
+	lon1 = np.radians(pointA[1])
+	lat1 = np.radians(pointA[2])
+	lon2 = np.radians(pointB[1])
+	lat2 = np.radians(pointB[2])
+	x = np.sin(lon2 - lon1) * np.cos(lat2)
+	y = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(lon2 - lon1)
+	return np.mod(np.degrees(np.arctan2(x, y)), 360)
+
+def douglas_peucker(data, tolerance):
+	# Indices of the points to keep so that the path stays within tolerance meters of the original one
+	# (same local flat earth approximation as great_circle, altitude in feet converted to meters)
+	R = 6371000
+	points = np.column_stack((R * np.radians(data[:, 1]) * np.cos(np.radians(np.mean(data[:, 2]))), R * np.radians(data[:, 2]), data[:, 3] / 3.28084))
+	keep = np.zeros(len(data), dtype=bool)
+	keep[[0, -1]] = len(data) > 0
+	segments = [(0, len(data) - 1)]
+	while segments:
+		(first, last) = segments.pop()
+		if last - first < 2:
+			continue
+		# Distance of the points between first and last to the segment [first, last]
+		segment = points[last] - points[first]
+		vectors = points[first + 1:last] - points[first]
+		length = np.dot(segment, segment)
+		position = np.clip(np.dot(vectors, segment) / length, 0.0, 1.0) if length > 0.0 else np.zeros(len(vectors))
+		distances = np.sqrt(((vectors - position[:, np.newaxis] * segment) ** 2).sum(axis=1))
+		index = np.argmax(distances)
+		if distances[index] > tolerance:
+			keep[first + 1 + index] = True
+			segments.append((first, first + 1 + index))
+			segments.append((first + 1 + index, last))
+	return np.flatnonzero(keep)
+
 def get_path_length(data):
-	total_length = 0.0
-	segment_list = []
-	segment_list.append(0.0)
-
-	for index in range(len(data)-1):
-		pointA = data[index]
-		pointB = data[index + 1]
-		segment_length = great_circle(pointA, pointB)
-		total_length += segment_length
-		segment_list.append(segment_length)
-	return total_length, segment_list
+	segment_list = np.concatenate(([0.0], great_circle(data[:-1].T, data[1:].T)))
+	return segment_list.sum(), segment_list
+
+# Queries on the cumulative distance column of FDR data (increasing, so found by binary search)
+def distance_rows(fdr_data, distances):
+	# Index of the first row at or after each distance (meters from the start)
+	return np.minimum(np.searchsorted(fdr_data[:, 8], distances), len(fdr_data) - 1)
+
+def time_at_distance(fdr_data, distance):
+	# Time (same unit as the time column) when the aircraft has flown distance meters
+	row = distance_rows(fdr_data, distance)
+	if (row == 0) or (fdr_data[row, 8] <= distance):
+		return fdr_data[row, 0]
+	(d0, d1) = fdr_data[row - 1:row + 1, 8]
+	(t0, t1) = fdr_data[row - 1:row + 1, 0]
+	return t0 + (t1 - t0) * (distance - d0) / (d1 - d0)
+
+def distance_decimation(fdr_data, step, previous_distance=None):
+	# Rows of the first point of each step meters of the path (the first row is kept if previous_distance,
+	# distance of the row before fdr_data, is None)
+	marks = np.floor(fdr_data[:, 8] / step)
+	previous = np.concatenate(([-1.0 if previous_distance is None else math.floor(previous_distance / step)], marks[:-1]))
+	return np.flatnonzero(marks > previous)
+
+class DistanceDecimator:
+	# Rows of the chunks of FDR data at each step meters of the path, and the last row of the flight
+	def __init__(self, step):
+		self.step = step
+		self.previous_distance = None
+		self.last_row = None # Last row fed if it was not kept
+
+	def feed(self, fdr_data):
+		if len(fdr_data) == 0:
+			return np.empty((0, len(fdr_fields)))
+		rows = distance_decimation(fdr_data, self.step, self.previous_distance)
+		self.previous_distance = fdr_data[-1, 8]
+		self.last_row = None if (len(rows) > 0) and (rows[-1] == len(fdr_data) - 1) else fdr_data[-1:].copy()
+		return fdr_data[rows]
+
+	def flush(self):
+		(last_row, self.last_row) = (self.last_row, None)
+		return last_row if last_row is not None else np.empty((0, len(fdr_fields)))
+
+def decimate_chunks(chunks, step):
+	decimator = DistanceDecimator(step)
+	for fdr_data in chunks:
+		fdr_data = decimator.feed(fdr_data)
+		if len(fdr_data) > 0:
+			yield fdr_data
+	fdr_data = decimator.flush()
+	if len(fdr_data) > 0:
+		yield fdr_data
+
+def decimate_distance(fdr_data, step):
+	return np.concatenate([np.empty((0, len(fdr_fields)))] + list(decimate_chunks([fdr_data], step)))
 
 #####
-# Clean and Filter input data
-def zero_listmaker(n):
-	return [0] * n
-
-def is_number(s):
+# Statistics of the conversion stages: the time between two switches is given to the current stage
+# (stages of the stream mode are nested generators, each one only gets its own time)
+def reset_peak_memory():
+	# Linux resets the peak resident memory (VmHWM) of the process when writing 5 to clear_refs
 	try:
-		float(s)
+		with open('/proc/self/clear_refs', 'w') as f:
+			f.write('5')
 		return True
-	except ValueError:
+	except IOError:
 		return False
 
-_start_time = float('NaN')
-def convert_time(value):
-	global _start_time
-	global time_factor
-	if math.isnan(_start_time):
-		_start_time = float(value)
+def peak_memory():
+	# Peak resident memory (MB) since the last reset, or since the start of the process
+	try:
+		with open('/proc/self/status') as f:
+			for line in f:
+				if line.startswith('VmHWM:'):
+					return int(line.split()[1]) / 1024.0
+	except IOError:
+		pass
+	try:
+		import resource # Unix only
+	except ImportError:
 		return 0.0
-	else:
-		return (float(value) - _start_time) / time_factor
+	# ru_maxrss is in kilobytes, but in bytes on macOS
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0)
+
+def cpu_time():
+	times = os.times()
+	return times[0] + times[1]
+
+def nb_rows(value):
+	if isinstance(value, tuple) and value:
+		value = value[0]
+	return len(value) if isinstance(value, np.ndarray) else None
+
+class PipelineStats:
+	def __init__(self):
+		self.names = []
+		self.stages = {}
+		self.current = None
+		self.last_wall = time.time()
+		self.last_cpu = cpu_time()
+		self.start = self.last_wall
+		reset_peak_memory()
+
+	def stage(self, name):
+		if name not in self.stages:
+			self.names.append(name)
+			self.stages[name] = {'stage': name, 'calls': 0, 'wall_time': 0.0, 'cpu_time': 0.0, 'rows_in': None, 'rows_out': None, 'peak_memory_mb': 0.0}
+		return self.stages[name]
+
+	def switch(self, name):
+		# Give the time and memory since the last switch to the current stage and start the name one
+		wall, cpu = time.time(), cpu_time()
+		if self.current is not None:
+			stage = self.stages[self.current]
+			stage['wall_time'] += wall - self.last_wall
+			stage['cpu_time'] += cpu - self.last_cpu
+			stage['peak_memory_mb'] = max(stage['peak_memory_mb'], peak_memory())
+			reset_peak_memory()
+		(previous, self.current) = (self.current, name)
+		self.last_wall, self.last_cpu = wall, cpu
+		return previous
+
+	def add_rows(self, stage, key, rows):
+		if rows is not None:
+			stage[key] = (stage[key] or 0) + rows
+
+	def run(self, name, function, *args):
+		stage = self.stage(name)
+		stage['calls'] += 1
+		self.add_rows(stage, 'rows_in', nb_rows(args[0]) if args else None)
+		previous = self.switch(name)
+		try:
+			result = function(*args)
+		finally:
+			self.switch(previous)
+		self.add_rows(stage, 'rows_out', nb_rows(result))
+		return result
+
+	def counted_chunks(self, stage, chunks):
+		for data in chunks:
+			self.add_rows(stage, 'rows_in', len(data))
+			yield data
+
+	def chunks(self, name, transform, chunks):
+		# Chunks of transform(chunks), the time spent to get each one is given to the name stage
+		stage = self.stage(name)
+		return self.timed_chunks(name, stage, transform(self.counted_chunks(stage, chunks)))
+
+	def timed_chunks(self, name, stage, chunks):
+		iterator = iter(chunks)
+		while True:
+			previous = self.switch(name)
+			try:
+				data = next(iterator)
+			except StopIteration:
+				return
+			finally:
+				self.switch(previous)
+			stage['calls'] += 1
+			self.add_rows(stage, 'rows_out', len(data))
+			yield data
+
+	def total_time(self):
+		return time.time() - self.start
+
+	def print_summary(self, title):
+		print "Statistics of " + title
+		print "    %-14s %6s %10s %10s %10s %10s %9s" % ('stage', 'calls', 'wall (s)', 'cpu (s)', 'rows in', 'rows out', 'peak (MB)')
+		for name in self.names:
+			stage = self.stages[name]
+			print "    %-14s %6d %10.3f %10.3f %10s %10s %9.1f" % (name, stage['calls'], stage['wall_time'], stage['cpu_time'], '-' if stage['rows_in'] is None else stage['rows_in'], '-' if stage['rows_out'] is None else stage['rows_out'], stage['peak_memory_mb'])
+		print "    %-14s %6s %10.3f" % ('total', '', self.total_time())
+
+	def write_json(self, json_file, title):
+		with open(json_file, 'w') as f:
+			json.dump({'input': title, 'total_time': self.total_time(), 'stages': [self.stages[name] for name in self.names]}, f, indent=2)
+
+# Functions called in the conversion whatever the stats option (nothing is measured when stats is None)
+def run_stage(stats, name, function, *args):
+	if stats is None:
+		return function(*args)
+	return stats.run(name, function, *args)
+
+def stage_chunks(stats, name, transform, chunks):
+	if stats is None:
+		return transform(chunks)
+	return stats.chunks(name, transform, chunks)
+
+#####
+# Clean and Filter input data
+def convert_time(value, start_time):
+	# value can also be an array of times
+	return (value - start_time) / time_factor
 
 def date_time_parse(value):
 	# Value format: UTC 24-Apr-2016 08:50:08.295
 	date_time = value.split('.')[0] # Split to avoid milli-seconds
 	conv = time.strptime(date_time, "%Z %d-%b-%Y %H:%M:%S")
 	return time.strftime("%d/%m/%Y", conv), time.strftime("%H:%M:%S", conv)
+
+def epoch_date_time(value, time_offset):
+	# Same result as date_time_parse from the epoch time of a row, time_offset is the number of seconds
+	# between the text date and the epoch time of a row
+	conv = time.gmtime(int(math.floor(value / time_factor)) + time_offset)
+	return time.strftime("%d/%m/%Y", conv), time.strftime("%H:%M:%S", conv)
 		
-def format_and_filter_csv(input_file, start_time, stop_time, output_file):
-	output = []
-	first_valid_row = True
+def to_float(value):
+	try:
+		return float(value)
+	except ValueError:
+		return float('NaN')
+
+def byte_table(characters):
+	table = np.zeros(256, dtype=np.bool_)
+	table[np.frombuffer(characters, dtype=np.uint8)] = True
+	return table
+
+# Bytes which can begin and end a number cell (nan and inf included, whitespace is skipped by numpy)
+number_first_bytes = byte_table('0123456789+-. \t\rnNiI')
+number_last_bytes = byte_table('0123456789. \t\rnNfFyY')
+
+def parse_lines(lines, layout, src_columns):
+	# Values of the src_columns of the lines with the right number of fields (other ones are not data) and
+	# these lines. The whole chunk is parsed by numpy at once, once the cells of the other columns are cut
+	if not lines:
+		return lines, np.empty((0, len(src_columns)))
+	separator = layout.separator
+	nb_separators = len(layout.fields) - 1
+	text = ''.join(lines)
+	if not text.endswith('\n'): # Last line of a file without end of line
+		text += '\n'
+	codes = np.frombuffer(text, dtype=np.uint8)
+	ends = np.flatnonzero(codes == ord('\n'))
+	separators = np.flatnonzero(codes == ord(separator))
+	starts = np.concatenate(([0], ends[:-1] + 1))
+	counts = np.diff(np.concatenate(([0], np.searchsorted(separators, ends))))
+	good = counts == nb_separators
+	if not good.all(): # Only the bytes of the good lines are kept below
+		separators = separators[np.repeat(good, counts)]
+		(lines, starts, ends) = (list(itertools.compress(lines, good.tolist())), starts[good], ends[good])
+		if not lines:
+			return lines, np.empty((0, len(src_columns)))
+	# Offsets of the separators around the cells of each line (before the start of the line for the first one)
+	bounds = np.column_stack((starts - 1, separators.reshape(len(lines), nb_separators), ends))
+	# Kept bytes: each run of parsed columns with the separator (or end of line) after it
+	columns = sorted(set(src_columns))
+	runs = [[column] for column in columns[:1]]
+	for column in columns[1:]:
+		if column == runs[-1][-1] + 1:
+			runs[-1].append(column)
+		else:
+			runs.append([column])
+	# Lines with a cell which is not a number (checked from its first and last bytes) are converted in
+	# Python, the other ones by numpy
+	cell_starts = bounds[:, columns] + 1
+	cell_ends = bounds[:, [column + 1 for column in columns]]
+	faulty = ((cell_ends <= cell_starts) | ~number_first_bytes[codes[cell_starts]] | ~number_last_bytes[codes[cell_ends - 1]]).any(axis=1)
+	parsed = np.flatnonzero(~faulty)
+	data = np.empty((len(lines), len(columns)))
+	if len(parsed) > 0:
+		limits = np.zeros(len(codes) + 1, dtype=np.int8)
+		for run in runs:
+			limits[bounds[parsed, run[0]] + 1] += 1
+			limits[bounds[parsed, run[-1] + 1] + 1] -= 1
+		keep = np.cumsum(limits[:-1], dtype=np.int8).view(np.bool_)
+		# A last 0 value so that numpy also stops before the end on a faulty last cell
+		values = np.fromstring(codes[keep].tostring()[:-1].replace('\n', separator) + separator + '0', dtype=np.float64, sep=separator)
+		if len(values) == len(parsed) * len(columns) + 1:
+			data[parsed] = values[:-1].reshape(len(parsed), len(columns))
+		else: # A cell not found by the check (1x2): all the lines are converted in Python
+			faulty[:] = True
+	for index in np.flatnonzero(faulty).tolist():
+		cells = lines[index].split(separator)
+		data[index] = [to_float(cells[column]) for column in columns]
+	return lines, data[:, [columns.index(column) for column in src_columns]]
+
+def read_csv_header(ifile, ff):
+	# Do not care of line 0 and 2 which contain text headers
+	reader = csv.reader([ifile.readline() for index in range(3)], delimiter=';', quotechar='|')
+	for index, row in enumerate(reader):
+		if (index == 1) and row: # Empty in a log without data
+			if (len(row) > 7) and ((row[0] == "1.2.1") or (row[0] == "1.2.4")): # Check the Flight24 version
+				# Don't get date from that field beacause it's not Zulu time
+				ff.location = row[3]
+				ff.pilot = row[5]
+				ff.aircraft = row[6]
+				ff.registration = row[7]
+			else:
+				eprint("Warning: you are using a Flight24 release different from the one tested.")
+
+def valid_rows(data, start_time, stop_time, nb_required=None):
+	# Indices of the rows from start_time without NaN values (in the nb_required first columns, all by
+	# default), until the first row after stop_time (the rows after it are not read), and whether that
+	# row was found
+	with np.errstate(invalid='ignore'): # NaN times of the faulty rows
+		after_stop = np.flatnonzero(data[:, 0] > np.floor(stop_time))
+		end = after_stop[0] if len(after_stop) > 0 else len(data)
+		valid = np.flatnonzero((data[:end, 0] >= np.floor(start_time)) & ~np.isnan(data[:end, :nb_required]).any(axis=1))
+	return valid, len(after_stop) > 0
+
+def read_csv_chunks(ifile, start_time, stop_time, fields=fields_dest, layout=None, nb_required=None):
+	layout = layout or flightrecorder24_layout
+	# Resolve once the position in the src row of each dest field
+	src_columns = [layout.src_column(field) for field in fields]
+	date_column = layout.fields.index(layout.date_field) if layout.date_field else None
+	separator = layout.separator
+	while True:
+		lines = list(itertools.islice(ifile, chunk_size))
+		if not lines:
+			break
+		(lines, data) = parse_lines(lines, layout, src_columns)
+		valid, stop = valid_rows(data, start_time, stop_time, nb_required)
+		if len(valid) > 0:
+			# Also give the text date of the first valid row (None if the layout has no date field)
+			yield (lines[valid[0]].split(separator)[date_column] if date_column is not None else None), data[valid]
+		if stop: # Stop parsing after epoch time > stop_time
+			break
+
+def read_flight_chunks(ifile, start_time, stop_time, ff, fields=fields_dest, layout=None, nb_required=None):
+	layout = layout or flightrecorder24_layout
+	for timedate, data in read_csv_chunks(ifile, start_time, stop_time, fields, layout, nb_required):
+		if not ff.date: # Store the date and time of the first valid row (beginning of flight)
+			ff.date, ff.time = layout.parse_date(timedate) if timedate is not None else epoch_date_time(data[0, 0], 0)
+		yield data
+
+def line_time(line, layout):
+	# Epoch time of a data line (None if the line does not contain data)
+	fields = line.split(layout.separator)
+	if len(fields) != len(layout.fields):
+		return None
+	try:
+		float(fields[layout.src_column('lat')])
+		return float(fields[layout.src_column('time')])
+	except ValueError:
+		return None
+
+def next_line_time(ifile, offset, layout):
+	# Epoch time of the first data line beginning after offset (None at the end of the file)
+	ifile.seek(offset)
+	ifile.readline()
+	for line in iter(ifile.readline, ''):
+		value = line_time(line, layout)
+		if value is not None:
+			return value
+	return None
+
+def seek_start_time(ifile, start_time, layout):
+	# Bisection on the byte offsets of the data (the epoch times of the log are increasing) to move
+	# before the line of start_time without reading the lines before
+	low = ifile.tell()
+	ifile.seek(0, os.SEEK_END)
+	high = ifile.tell()
+	start = low
+	while high - low > seek_precision:
+		middle = (low + high) // 2
+		value = next_line_time(ifile, middle, layout)
+		if (value is None) or (value >= np.floor(start_time)):
+			high = middle
+		else:
+			low = middle
+	ifile.seek(low)
+	if low > start: # Skip the end of the line (before start_time as the next one)
+		ifile.readline()
+
+def read_flight_file_chunks(input_file, start_time, stop_time, ff, fields=fields_dest, layout=None, nb_required=None):
+	layout = layout or flightrecorder24_layout
+	with open_input(input_file) as ifile:
+		layout.read_header(ifile, ff)
+		if (start_time > 0) and isinstance(ifile, file): # Compressed files are read from the beginning
+			seek_start_time(ifile, start_time, layout)
+		for data in read_flight_chunks(ifile, start_time, stop_time, ff, fields, layout, nb_required):
+			yield data
+
+flightrecorder24_layout = CsvLayout('flightrecorder24', flightrecorder24_fields, {}, ';', read_csv_header, 'timedate', date_time_parse)
+
+#####
+# Input readers: the reader of a file is found from its extension (after a .gz or .bz2 extension of
+# compressed files which are read on the fly)
+input_readers = []
+compressed_files = {'.gz': gzip.GzipFile, '.bz2': bz2.BZ2File}
+
+def register_reader(reader):
+	input_readers.append(reader)
+
+def csv_reader(layout, extensions):
+	# Input reader of the csv logs of layout (to be registered with register_reader)
+	return InputReader(layout.name, extensions, functools.partial(read_flight_file_chunks, layout=layout), layout=layout)
+
+@contextlib.contextmanager
+def unclosed(ifile):
+	yield ifile
+
+def open_input(input_file):
+	if not isinstance(input_file, basestring): # File object of the caller (which is left open)
+		return unclosed(input_file)
+	opener = compressed_files.get(os.path.splitext(input_file)[1].lower(), open)
+	return opener(input_file, 'rb')
+
+def input_name(input_file):
+	# Name of an input file given by name or as a file object
+	return input_file if isinstance(input_file, basestring) else getattr(input_file, 'name', '<file object>')
+
+def file_flight_name(file):
+	# Name of the flight of a file given by name or as a file object (default_flight_name without a file name)
+	name = file if isinstance(file, basestring) else getattr(file, 'name', None)
+	if not isinstance(name, basestring) or name.startswith('<'): # <stdin>, <fdopen>...
+		return default_flight_name
+	return flight_name(name)
+
+def input_extension(input_file):
+	(name, extension) = os.path.splitext(input_file.lower())
+	if extension in compressed_files:
+		extension = os.path.splitext(name)[1]
+	return extension
+
+def find_reader(input_file, name=None):
+	if name is not None:
+		for reader in input_readers:
+			if reader.name == name:
+				return reader
+		raise ValueError("unknown input reader " + name)
+	extension = input_extension(input_name(input_file))
+	for reader in input_readers:
+		if extension in reader.extensions:
+			return reader
+	return input_readers[0] # Flight Recorder 24 logs whatever their name
+
+def read_input_chunks(input_file, start_time, stop_time, ff, fields=fields_dest, reader=None):
+	return find_reader(input_file, reader).read_chunks(input_file, start_time, stop_time, ff, fields)
+
+def point_chunks(points, start_time, stop_time, ff, fields):
+	# Chunks of the valid rows of points (tuples of the fields_dest values) of the readers parsing each point
+	columns = [fields_dest.index(field) for field in fields]
+	for rows in iter(lambda: list(itertools.islice(points, chunk_size)), []):
+		data = np.array(rows, dtype=np.float64)
+		valid, stop = valid_rows(data, start_time, stop_time)
+		if len(valid) > 0:
+			if not ff.date:
+				ff.date, ff.time = epoch_date_time(data[valid[0], 0], 0)
+			yield data[valid][:, columns]
+		if stop:
+			break
+
+def iso_time(value):
+	# Epoch time of an ISO 8601 date and time (2016-04-24T08:50:08.295Z or with a +02:00 time zone)
+	value = value.strip()
+	offset = 0
+	if value.endswith('Z'):
+		value = value[:-1]
+	elif (len(value) > 19) and (value[-6] in '+-') and (value[-3] == ':'):
+		offset = (int(value[-5:-3]) * 60 + int(value[-2:])) * (1 if value[-6] == '+' else -1) * 60
+		value = value[:-6]
+	seconds = calendar.timegm(time.strptime(value[:19], "%Y-%m-%dT%H:%M:%S")) - offset
+	return (seconds + float('0' + value[19:])) * time_factor
+
+# GPX track points: only the position, elevation and time are logged, the yaw is the bearing to the next point
+def gpx_points(input_file):
+	previous = None
+	with open_input(input_file) as ifile:
+		for event, element in ElementTree.iterparse(ifile):
+			if element.tag.rsplit('}', 1)[-1] != 'trkpt':
+				continue
+			values = dict((child.tag.rsplit('}', 1)[-1], child.text) for child in element)
+			values.update(element.attrib)
+			element.clear()
+			try:
+				point = [iso_time(values['time']), float(values['lon']), float(values['lat']), float(values.get('ele') or 0.0) * 3.28084, 0.0, 0.0, 0.0]
+			except (KeyError, TypeError, ValueError):
+				continue
+			if previous is not None:
+				previous[6] = bearing(previous, point)
+				yield previous
+				point[6] = previous[6]
+			previous = point
+	if previous is not None:
+		yield previous
+
+def read_gpx_chunks(input_file, start_time, stop_time, ff, fields=fields_dest):
+	return point_chunks(gpx_points(input_file), start_time, stop_time, ff, fields)
+
+# NMEA 0183 sentences: RMC gives the date, position and course, GGA the position and altitude of a fix
+def nmea_coordinate(value, hemisphere):
+	degrees = int(float(value) / 100)
+	coordinate = degrees + (float(value) - degrees * 100) / 60.0
+	return -coordinate if hemisphere in ('S', 'W') else coordinate
+
+def nmea_fields(line):
+	# Fields of a sentence with a valid checksum (None for other lines)
+	line = line.strip()
+	if not line.startswith('$'):
+		return None
+	(body, separator, checksum) = line[1:].partition('*')
+	if separator and (checksum[:2].upper() != '%02X' % functools.reduce(operator.xor, map(ord, body), 0)):
+		return None
+	return body.split(',')
+
+def nmea_points(input_file):
+	date = None
+	fix_time = None
+	point = None
+	alt = 0.0 # Last known altitude and course for fixes without them
+	yaw = 0.0
+	with open_input(input_file) as ifile:
+		for line in ifile:
+			fields = nmea_fields(line)
+			if (fields is None) or (len(fields) < 10):
+				continue
+			sentence = fields[0][-3:]
+			if not (((sentence == 'RMC') and (fields[2] == 'A')) or ((sentence == 'GGA') and (fields[6] not in ('', '0')))):
+				continue # Other sentences or no fix
+			if fields[1] != fix_time: # New fix
+				if (point is not None) and (date is not None):
+					yield point
+				fix_time = fields[1]
+				point = None
+			try:
+				point = point or [0.0, 0.0, 0.0, alt, 0.0, 0.0, 0.0]
+				if sentence == 'RMC':
+					date = fields[9]
+					yaw = float(fields[8]) if fields[8] else yaw
+					point[1] = nmea_coordinate(fields[5], fields[6])
+					point[2] = nmea_coordinate(fields[3], fields[4])
+				else:
+					alt = float(fields[9]) * 3.28084 if fields[9] else alt
+					point[1] = nmea_coordinate(fields[4], fields[5])
+					point[2] = nmea_coordinate(fields[2], fields[3])
+					point[3] = alt
+				if date is not None:
+					seconds = calendar.timegm((2000 + int(date[4:6]), int(date[2:4]), int(date[0:2]), int(fix_time[0:2]), int(fix_time[2:4]), 0, 0, 0, 0))
+					point[0] = (seconds + float(fix_time[4:])) * time_factor
+				point[6] = yaw
+			except (IndexError, ValueError):
+				point = None
+	if (point is not None) and (date is not None):
+		yield point
+
+def read_nmea_chunks(input_file, start_time, stop_time, ff, fields=fields_dest):
+	return point_chunks(nmea_points(input_file), start_time, stop_time, ff, fields)
+
+# Native binary format: a header of binary_header_size bytes (magic line and json description of the
+# flight) followed by the rows of float64 values, which are memory-mapped without parsing
+binary_magic = 'TOFDR 1\n'
+binary_header_size = 4096
+
+def flight_time_offset(ff, first_time):
+	# Seconds between the text date and the epoch time, to find the date of any row
+	return calendar.timegm(time.strptime(ff.date + ' ' + ff.time, "%d/%m/%Y %H:%M:%S")) - int(math.floor(first_time / time_factor))
+
+class BinaryWriter:
+	def __init__(self, flight_feature, binary_file, fields=fields_dest):
+		self.flight_feature = flight_feature
+		self.fields = fields
+		self.first_time = None
+		self.last_time = None
+		self.sorted_times = True
+		self.nb_rows = 0
+		self.f, self.owned = open_output(binary_file)
+		self.offset = self.f.tell()
+		self.f.write(' ' * binary_header_size) # Written when the features of the flight are known
+
+	def write(self, data):
+		if len(data) == 0:
+			return
+		times = data[:, 0]
+		if self.first_time is None:
+			self.first_time = times[0]
+		elif times[0] < self.last_time:
+			self.sorted_times = False
+		self.sorted_times = self.sorted_times and bool(np.all(np.diff(times) >= 0))
+		self.last_time = times[-1]
+		self.nb_rows += len(data)
+		self.f.write(np.ascontiguousarray(data, dtype='<f8').tostring())
+
+	def close(self):
+		ff = self.flight_feature
+		description = {'fields': self.fields, 'rows': self.nb_rows, 'sorted': self.sorted_times, 'time_offset': flight_time_offset(ff, self.first_time) if self.nb_rows > 0 else 0}
+		for name in ('location', 'pilot', 'aircraft', 'registration'):
+			description[name] = getattr(ff, name, '')
+		header = binary_magic + json.dumps(description, encoding='latin-1') + '\n'
+		if len(header) > binary_header_size:
+			raise ValueError("flight description too long for the binary format")
+		self.f.seek(self.offset)
+		self.f.write(header.ljust(binary_header_size - 1) + '\n')
+		self.f.seek(0, os.SEEK_END)
+		if self.owned:
+			self.f.close()
+
+def write_binary(data, flight_feature, binary_file):
+	binary = BinaryWriter(flight_feature, binary_file)
+	binary.write(data)
+	binary.close()
+
+def read_binary(binary_file):
+	# Memory-mapped rows of a binary file (read in memory from a file object), features of the flight,
+	# time offset, sorted times and fields
+	with open_input(binary_file) as f:
+		header = f.read(binary_header_size)
+		rows = f.read() if not isinstance(binary_file, basestring) else None
+	if not header.startswith(binary_magic) or (len(header) < binary_header_size):
+		raise ValueError(input_name(binary_file) + " is not a tofdr binary file")
+	description = json.loads(header[len(binary_magic):])
+	fields = [str(field) for field in description['fields']]
 	ff = FlightFeature()
-	with open(input_file, 'rb') as ifile:
-		reader = csv.reader(ifile, delimiter=';', quotechar='|')
-		for index, row in enumerate(reader):
-			if (index < 3):
-				# Do not care of line 0 and 2 which contain text headers
-				if (index == 1):
-					if (row[0] == "1.2.1") or (row[0] == "1.2.4"): # Check the Flight24 version
-						# Don't get date from that field beacause it's not Zulu time
-						ff.location = row[3]
-						ff.pilot = row[5]
-						ff.aircraft = row[6]
-						ff.registration = row[7]
-					else:
-						eprint("Warning: you are using a Flight24 release different from the one tested.")
-			else: # Index line >= 3 contains relevant data
-				# If row correspond to data that we want to convert
-				if (len(row) == len(fields_srcs)) and (is_number(row[2])):
-					if (int(row[1]) < int(start_time)): # Don't care about epoch time < start_time
-						continue
-					if (int(row[1]) > int(stop_time)): # Stop parsing after epoch time > stop_time
-						break
-					if (first_valid_row): # Store the date and time of the first valid row (beginning of flight)
-						ff.date, ff.time = date_time_parse(row[0])
-						first_valid_row = False
-					nan_val = False
-					output_row = zero_listmaker(len(fields_dest))
-					for column in range(len(fields_srcs)):
-						# Try to find src field in dest
-						try:
-							ind = fields_dest.index(fields_srcs[column])
-						except ValueError:
-							ind = -1
-						# if field is present, then add value to the right place
-						if (ind != -1):
-							# if (fields_srcs[column] == 'time'):
-								# value = convert_time(row[column])
-							# else:
-							value = float(row[column])
-							if (not is_number(value)) or (math.isnan(value)):
-								nan_val = True
-								break
-							output_row[ind] = value
-					#output_row = ['DATA'] + output_row + ['']
-					if not(nan_val):
-						output.append(output_row)
+	for name in ('location', 'pilot', 'aircraft', 'registration'):
+		setattr(ff, name, description[name].encode('latin-1'))
+	# Number of rows from the size of the file, which is right even if the file was not closed
+	nb_rows = (len(rows) if rows is not None else os.path.getsize(binary_file) - binary_header_size) // (8 * len(fields))
+	if rows is not None:
+		data = np.frombuffer(rows, dtype='<f8', count=nb_rows * len(fields)).reshape(nb_rows, len(fields))
+	elif nb_rows == 0:
+		data = np.empty((0, len(fields)))
+	else:
+		data = np.memmap(binary_file, dtype='<f8', mode='r', offset=binary_header_size, shape=(nb_rows, len(fields)))
+	return data, ff, description['time_offset'], description['sorted'], fields
+
+def read_binary_chunks(input_file, start_time, stop_time, ff, fields=fields_dest):
+	data, binary_ff, time_offset, sorted_times, binary_fields = read_binary(input_file)
+	rows, window_ff = cached_window(data, binary_ff, time_offset, sorted_times, start_time, stop_time)
+	ff.__dict__.update(window_ff.__dict__)
+	columns = [binary_fields.index(field) for field in fields]
+	for start in range(0, len(rows), chunk_size):
+		# Chunks are copied from the mapped file as fixes are applied in place
+		if sorted_times: # Contiguous rows
+			chunk = data[rows[start]:rows[min(start + chunk_size, len(rows)) - 1] + 1]
+		else:
+			chunk = np.take(data, rows[start:start + chunk_size], axis=0)
+		yield np.array(chunk[:, columns])
+
+register_reader(csv_reader(flightrecorder24_layout, ['.csv', '.txt']))
+register_reader(InputReader('gpx', ['.gpx'], read_gpx_chunks))
+register_reader(InputReader('nmea', ['.nmea', '.nma'], read_nmea_chunks))
+register_reader(InputReader('tofdr', ['.tofdr'], read_binary_chunks, cached=False))
+
+def format_and_filter_csv(input_file, start_time, stop_time, output_file, reader=None):
+	ff = FlightFeature()
+	chunks = list(read_input_chunks(input_file, start_time, stop_time, ff, fields_dest, reader))
+	# Data are stored by column (Fortran order) as all treatments are done column by column
+	output = np.empty((sum(len(data) for data in chunks), len(fields_dest)), order='F')
+	if chunks:
+		np.concatenate(chunks, out=output)
 
 	# with open(output_file, 'wb') as ofile:
 		# writer = csv.writer(ofile, delimiter=';')
 		# writer.writerows(output)
 	return output, ff
 
+#####
+# Cache of parsed flights: the data of the whole input file are stored in binary format and are
+# memory-mapped by the next runs on the same file (whatever the fix, smooth or time options)
+parser_version = '4' # Change it when the parsing changes to invalidate the cached flights
+
+def default_cache_dir():
+	return os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')), 'tofdr')
+
+def make_cache_dir(cache_dir):
+	if not os.path.isdir(cache_dir):
+		try:
+			os.makedirs(cache_dir)
+		except OSError: # Created at the same time by another process
+			pass
+
+def replace_file(source, target):
+	# os.rename does not overwrite an existing target on Windows (Python 2 has no os.replace)
+	if os.name == 'nt' and os.path.exists(target):
+		try:
+			os.remove(target)
+		except OSError: # Removed at the same time by another process
+			pass
+	os.rename(source, target)
+
+def cache_stat_file(input_file, cache_dir, reader):
+	# The content hash of a file is kept for its path, size and modification time to avoid reading
+	# the whole file again when it has not changed
+	stat = os.stat(input_file)
+	# (the parser version and fields are also in this hash so that the content key changes with them)
+	return os.path.join(cache_dir, hashlib.sha1('%s;%d;%r;%s;%s;%s' % (os.path.abspath(input_file), stat.st_size, stat.st_mtime, reader.name, parser_version, ';'.join(fields_dest))).hexdigest() + '.key')
+
+def known_cache_key(input_file, cache_dir, reader):
+	# Content key of a file already hashed, None otherwise (the file is not read)
+	try:
+		with open(cache_stat_file(input_file, cache_dir, reader), 'rb') as f:
+			return f.read()
+	except IOError:
+		return None
+
+def cache_key(input_file, cache_dir, reader):
+	known_key = known_cache_key(input_file, cache_dir, reader)
+	if known_key is not None:
+		return known_key
+	stat_file = cache_stat_file(input_file, cache_dir, reader)
+	key = hashlib.sha1(parser_version + ';' + reader.name + ';' + ';'.join(fields_dest))
+	with open(input_file, 'rb') as ifile:
+		for block in iter(lambda: ifile.read(1 << 20), ''):
+			key.update(block)
+	make_cache_dir(cache_dir)
+	with open(stat_file, 'wb') as f:
+		f.write(key.hexdigest())
+	return key.hexdigest()
+
+def read_cache(cache_dir, key):
+	data_file = os.path.join(cache_dir, key + '.npy')
+	try:
+		with open(os.path.join(cache_dir, key + '.meta'), 'rb') as meta_file:
+			meta = meta_file.read().split('\n')
+		data = np.load(data_file, mmap_mode='r')
+		os.utime(data_file, None) # Most recently used flight
+	except (IOError, OSError, ValueError):
+		return None
+	ff = FlightFeature()
+	(ff.location, ff.pilot, ff.aircraft, ff.registration) = meta[:4]
+	return data, ff, int(meta[4]), meta[5] == 'sorted'
+
+def write_cache(cache_dir, key, data, ff, time_offset, sorted_times, max_size):
+	make_cache_dir(cache_dir)
+	# Write temporary files renamed at the end, so that other processes never read incomplete files
+	data_file = tempfile.NamedTemporaryFile(dir=cache_dir, suffix='.tmp', delete=False)
+	np.save(data_file, data)
+	data_file.close()
+	meta_file = tempfile.NamedTemporaryFile(dir=cache_dir, suffix='.tmp', delete=False)
+	meta_file.write('\n'.join([ff.location, ff.pilot, getattr(ff, 'aircraft', ''), ff.registration, str(time_offset), 'sorted' if sorted_times else 'unsorted']))
+	meta_file.close()
+	replace_file(meta_file.name, os.path.join(cache_dir, key + '.meta'))
+	replace_file(data_file.name, os.path.join(cache_dir, key + '.npy'))
+	evict_cache(cache_dir, max_size)
+
+def evict_cache(cache_dir, max_size):
+	# Remove the least recently used flights until the cache size is under max_size bytes
+	entries = []
+	for data_file in glob.glob(os.path.join(cache_dir, '*.npy')):
+		meta_file = data_file[:-len('.npy')] + '.meta'
+		try:
+			size = os.path.getsize(data_file) + os.path.getsize(meta_file)
+			entries.append((os.path.getmtime(data_file), size, data_file, meta_file))
+		except OSError: # Removed by another process
+			pass
+	total_size = sum(entry[1] for entry in entries)
+	for mtime, size, data_file, meta_file in sorted(entries):
+		if total_size <= max_size:
+			break
+		for filename in (data_file, meta_file):
+			try:
+				os.remove(filename)
+			except OSError:
+				pass
+		total_size -= size
+	# Content keys of files which are no longer cached (kept for the files still in the cache)
+	cached_keys = set(os.path.basename(data_file)[:-len('.npy')] for data_file in glob.glob(os.path.join(cache_dir, '*.npy')))
+	for stat_file in glob.glob(os.path.join(cache_dir, '*.key')):
+		try:
+			with open(stat_file, 'rb') as f:
+				key = f.read()
+			if key not in cached_keys:
+				os.remove(stat_file)
+		except (IOError, OSError): # Removed by another process
+			pass
+
+def clear_cache(cache_dir):
+	for filename in glob.glob(os.path.join(cache_dir, '*.npy')) + glob.glob(os.path.join(cache_dir, '*.meta')) + glob.glob(os.path.join(cache_dir, '*.key')) + glob.glob(os.path.join(cache_dir, '*.tmp')):
+		os.remove(filename)
+
+def use_cache(input_file, options):
+	# File objects are not cached (no name nor modification time)
+	return options.cache and isinstance(input_file, basestring) and find_reader(input_file, options.reader).cached
+
+def find_cached_flight(input_file, options):
+	# Cached flight of an input file already hashed, None otherwise (without reading the input file:
+	# a time window or the stream mode do not need the whole file)
+	key = known_cache_key(input_file, options.cache_dir, find_reader(input_file, options.reader))
+	return read_cache(options.cache_dir, key) if key is not None else None
+
+def load_cached_flight(input_file, options):
+	# Data of the whole input file and its features, from the cache or parsed and added to the cache
+	key = cache_key(input_file, options.cache_dir, find_reader(input_file, options.reader))
+	cached = read_cache(options.cache_dir, key)
+	if cached is not None:
+		return cached
+	data, ff = format_and_filter_csv(input_file, 0, float('inf'), None, options.reader)
+	if len(data) == 0:
+		return data, ff, 0, True
+	time_offset = flight_time_offset(ff, data[0][0])
+	sorted_times = bool(np.all(np.diff(data[:, 0]) >= 0))
+	write_cache(options.cache_dir, key, data, ff, time_offset, sorted_times, options.cache_size * 1024 * 1024)
+	return data, ff, time_offset, sorted_times
+
+def cached_window(data, ff, time_offset, sorted_times, start_time, stop_time):
+	# Rows between start_time and stop_time like format_and_filter_csv (stop at the first row after stop_time)
+	times = data[:, 0]
+	if sorted_times: # Bisection, only a few times are read from the memory-mapped data
+		first = np.searchsorted(times, np.floor(start_time), 'left')
+		rows = np.arange(first, max(first, np.searchsorted(times, np.floor(stop_time), 'right')))
+	else:
+		after_stop = np.flatnonzero(times > np.floor(stop_time))
+		end = after_stop[0] if len(after_stop) > 0 else len(times)
+		rows = np.flatnonzero(times[:end] >= np.floor(start_time))
+	window_ff = FlightFeature()
+	window_ff.__dict__.update(ff.__dict__)
+	if len(rows) > 0:
+		window_ff.date, window_ff.time = epoch_date_time(times[rows[0]], time_offset)
+	return rows, window_ff
+
+def load_flight(input_file, options):
+	if not use_cache(input_file, options):
+		return format_and_filter_csv(input_file, options.start_time, options.stop_time, None, options.reader)
+	if (options.start_time > 0) or (options.stop_time < float('inf')):
+		# Only the time window is parsed (from seek_start_time) if the flight is not in the cache yet,
+		# the cache is filled by the conversions of the whole file
+		cached = find_cached_flight(input_file, options)
+		if cached is None:
+			return format_and_filter_csv(input_file, options.start_time, options.stop_time, None, options.reader)
+		data, ff, time_offset, sorted_times = cached
+	else:
+		data, ff, time_offset, sorted_times = load_cached_flight(input_file, options)
+	rows, ff = cached_window(data, ff, time_offset, sorted_times, options.start_time, options.stop_time)
+	# Copy only the rows of the window from the memory-mapped data (fixes are applied in place)
+	output = np.empty((len(rows), len(fields_dest)), order='F')
+	np.take(data, rows, axis=0, out=output)
+	return output, ff
+
+def load_flight_chunks(input_file, options, ff):
+	# Data by chunks for the stream mode: from the cache if the flight is already there (the cache is
+	# not filled in stream mode as it needs the whole data)
+	cached = find_cached_flight(input_file, options) if use_cache(input_file, options) else None
+	if cached is None:
+		for data in read_input_chunks(input_file, options.start_time, options.stop_time, ff, fields_dest, options.reader):
+			yield data
+		return
+	data, cached_ff, time_offset, sorted_times = cached
+	rows, window_ff = cached_window(data, cached_ff, time_offset, sorted_times, options.start_time, options.stop_time)
+	ff.__dict__.update(window_ff.__dict__)
+	for start in range(0, len(rows), chunk_size):
+		yield np.take(data, rows[start:start + chunk_size], axis=0)
+
 #####
 # Fix and smooth data
 def fix_raw_data(data, fix_param):
-	fixed_data = []
-	for index, row in enumerate(data):
-		fixed_row = row
-		# Altitude correction
-		altitude = row[3] + fix_param.elevation
-		if altitude < fix_param.airport_elevation:
-			altitude = fix_param.airport_elevation
-		fixed_row[3] = altitude
-		# Roll correction
-		roll = row[4]
-		if (roll > 0):
-			roll -= fix_param.roll
+	# Corrections are applied in place on the columns
+	# Altitude correction
+	np.maximum(data[:, 3] + fix_param.elevation, fix_param.airport_elevation, out=data[:, 3])
+	# Roll correction
+	roll = data[:, 4]
+	roll += np.where(roll > 0, -fix_param.roll, fix_param.roll)
+	# Pitch correction
+	data[:, 5] += fix_param.pitch
+	# Yaw correction
+	np.mod(data[:, 6] + fix_param.yaw, 360, out=data[:, 6])
+	return data
+
+def smooth_data(data, sigma, window=0):
+	# Smooth in place all the columns of raw data
+	return smooth_columns(data, *column_filters(range(data.shape[1]), sigma, window), angle_columns=raw_angle_columns)
+
+def column_filters(columns, sigma, window):
+	# Sigmas and windows by column of smooth_columns from the smooth options
+	return dict.fromkeys(columns, sigma), (dict.fromkeys(columns, window) if window > 1 else None)
+
+def moving_average(values, window, angle_columns=()):
+	# Centered moving average of the columns of values along time, reflected at both ends like
+	# gaussian_filter1d: the sums of the windows are differences of cumulative sums, O(n) whatever the window
+	(n, nb_columns) = values.shape
+	before = window // 2
+	after = window - 1 - before
+	offset = values[:1].copy() # Cumulative sums of the differences with the first row keep their precision
+	sums = np.zeros((n + window, nb_columns), order='F')
+	padded = sums[1:]
+	center = padded[before:before + n]
+	np.subtract(values, offset, out=center)
+	for column in angle_columns: # Angles (degrees) are made continuous to average across 0/360
+		center[:, column] = np.degrees(np.unwrap(np.radians(values[:, column]))) - offset[0, column]
+	if n >= max(before, after):
+		padded[:before] = center[:before][::-1]
+		padded[before + n:] = center[::-1][:after]
+	else:
+		padded[:] = np.pad(center.copy(), ((before, after), (0, 0)), 'symmetric')
+	np.cumsum(padded, axis=0, out=padded)
+	averages = sums[window:] - sums[:-window]
+	averages /= window
+	averages += offset
+	for column in angle_columns:
+		averages[:, column] = np.mod(averages[:, column], 360)
+	return averages
+
+def smooth_columns(data, sigmas, windows=None, angle_columns=()):
+	# Smooth in place the columns of data along time with a gaussian filter of sigmas[column], or with a
+	# moving average of windows[column] rows if windows is set (columns of the same value are smoothed at once)
+	filters = windows if windows else sigmas
+	groups = {}
+	for column, value in filters.items():
+		if value > (1 if windows else 0):
+			groups.setdefault(value, []).append(column)
+	if (len(data) == 0) or not groups:
+		return data
+	if not windows:
+		from scipy.ndimage import gaussian_filter1d
+	for value, columns in groups.items():
+		columns.sort()
+		contiguous = columns == range(columns[0], columns[-1] + 1)
+		if contiguous:
+			values = data[:, columns[0]:columns[-1] + 1] # View of the columns smoothed without copy
 		else:
-			roll += fix_param.roll
-		fixed_row[4] = roll
-		# Pitch correction
-		fixed_row[5] = row[5] + fix_param.pitch
-		# Yaw correction
-		fixed_row[6] = (row[6] + fix_param.yaw) % 360
-
-		fixed_data.append(fixed_row)
-	return fixed_data
-
-def smooth_data(data, sigma):
-	return smooth_row_data(data, -1, sigma)
-
-def smooth_row_data(data, row_num, sigma):
-	mat = list(zip(*data))
-
-	t = np.linspace(0, 1, len(mat[0]))
-	t2 = np.linspace(0, 1, len(mat[0]))
-
-	ret_data = []
-	for index, row in enumerate(mat):
-		if row_num == -1:
-			values_interp = np.interp(t2, t, row)
-			values_filtered = gaussian_filter1d(values_interp, sigma)
-			ret_data.append(values_filtered)
+			values = data[:, columns]
+		if windows:
+			values[:] = moving_average(values, value, [columns.index(column) for column in angle_columns if column in columns])
 		else:
-			if index == row_num:
-				values_interp = np.interp(t2, t, row)
-				values_filtered = gaussian_filter1d(values_interp, sigma)
-				ret_data.append(values_filtered)
-			else:
-				ret_data.append(row)
-
-	return list(zip(*ret_data))
+			gaussian_filter1d(values, value, axis=0, output=values)
+		if not contiguous:
+			data[:, columns] = values
+	return data
+
+class ChunkSmoother:
+	# Overlap-save smoothing: each chunk is smoothed with the end of the previous one (and waits for the
+	# beginning of the next one) so that the result is the same as smooth_columns on the whole data.
+	# feed() gives the rows already final, flush() the last ones (smoothed without the next rows)
+	def __init__(self, sigmas, windows=None, angle_columns=()):
+		self.sigmas = sigmas
+		self.windows = windows
+		self.angle_columns = angle_columns
+		if windows:
+			self.radius = max(window // 2 for window in windows.values())
+		else:
+			self.radius = max(int(4.0 * float(sigma) + 0.5) if sigma > 0 else 0 for sigma in sigmas.values()) # Same kernel radius as gaussian_filter1d
+		self.buffer = None
+		self.nb_context = 0 # Number of rows at the beginning of buffer already smoothed, only kept as context
+
+	def feed(self, data):
+		if self.radius == 0:
+			return data
+		self.buffer = data if self.buffer is None else np.concatenate((self.buffer, data))
+		ready = len(self.buffer) - self.radius
+		if ready <= self.nb_context:
+			return self.buffer[:0]
+		# Smoothed in a copy as the end of buffer is kept for the next chunks
+		smoothed_data = smooth_columns(self.buffer.copy(order='F'), self.sigmas, self.windows, self.angle_columns)[self.nb_context:ready]
+		keep = max(ready - self.radius, 0)
+		self.buffer = self.buffer[keep:]
+		self.nb_context = ready - keep
+		return smoothed_data
+
+	def flush(self):
+		# The buffer is kept: the last rows are smoothed again when other rows are fed (incremental mode)
+		if (self.radius == 0) or (self.buffer is None):
+			return np.empty((0, 0))
+		if len(self.buffer) <= self.nb_context:
+			return self.buffer[:0]
+		return smooth_columns(self.buffer.copy(order='F'), self.sigmas, self.windows, self.angle_columns)[self.nb_context:]
+
+def smooth_chunks(chunks, sigmas, windows=None, angle_columns=()):
+	smoother = ChunkSmoother(sigmas, windows, angle_columns)
+	for data in chunks:
+		data = smoother.feed(data)
+		if (smoother.radius == 0) or (len(data) > 0):
+			yield data
+	data = smoother.flush()
+	if len(data) > 0:
+		yield data
 
 #####
-# Manage FDR format
-def to_fdr(data, sigma):
-	global time_factor
-
-	pos_lst = []
-	timelst = []
-	fdr_data=[]
-
-	cumT = 0.0
-
-	for index, row in enumerate(data):
-		if index == 0:
-			Tdif = 0.0
+# Resample data on a uniform time grid of rate rows per second (from the first time of the flight)
+def resample_rows(data, grid, angle_columns=()):
+	resampled_data = np.empty((len(grid), data.shape[1]), order='F')
+	resampled_data[:, 0] = grid
+	for column in range(1, data.shape[1]):
+		if column in angle_columns: # Angles (degrees) are interpolated the short way across 0/360
+			values = np.interp(grid, data[:, 0], np.unwrap(np.radians(data[:, column])))
+			resampled_data[:, column] = np.mod(np.degrees(values), 360)
 		else:
-			Tdif = row[0] - data[index - 1][0]
-		cumT += Tdif
-		timelst.append(cumT)
-		
-		time_chng = (timelst[len(timelst) - 1] - timelst[len(timelst) - 2]) / time_factor
-		if time_chng == 0.0:
-			time_chng = 0.0000000001
-			if index != 0:
-				eprint("Warning: suspect time at index " + str(index) + " !")
-		
-		# Get bearing
-		roll = row[4]
-		pitch = row[5]
-		bearing = row[6] # bearing = yaw
-
-		t_st = timelst[len(timelst) - 1]
-		pos_lst.append([row[0], row[1], row[2], row[3]]) # Done: added row[0] to be able to use great_circle
-		pointA = (pos_lst[len(pos_lst) - 2])
-		pointB = (pos_lst[len(pos_lst) - 1])
-		d = great_circle(pointA, pointB)
-		speed = (d / abs(time_chng)) / 0.51444444
-
-		fdr_data.append([t_st, row[1], row[2], row[3], speed, bearing, pitch, roll])
+			resampled_data[:, column] = np.interp(grid, data[:, 0], data[:, column])
+	return resampled_data
+
+class Resampler:
+	def __init__(self, rate, angle_columns=()):
+		self.period = time_factor / rate
+		self.angle_columns = angle_columns
+		self.first_time = None
+		self.nb_points = 0 # Number of points of the grid already given
+		self.last_row = None # Last row of the previous chunk, to interpolate between two chunks
+
+	def feed(self, data):
+		if len(data) == 0:
+			return data
+		if np.any(np.diff(data[:, 0]) < 0): # np.interp needs increasing times
+			data = data[np.argsort(data[:, 0], kind='mergesort')]
+		if self.last_row is None:
+			self.first_time = data[0, 0]
+		else:
+			data = np.concatenate((self.last_row, data[data[:, 0] >= self.last_row[0, 0]]))
+		end = int(math.floor((data[-1, 0] - self.first_time) / self.period)) + 1
+		grid = self.first_time + self.period * np.arange(self.nb_points, end)
+		self.nb_points = max(end, self.nb_points)
+		self.last_row = data[-1:].copy()
+		return resample_rows(data, grid, self.angle_columns)
+
+def resample_chunks(chunks, rate, angle_columns=()):
+	resampler = Resampler(rate, angle_columns)
+	for data in chunks:
+		data = resampler.feed(data)
+		if len(data) > 0:
+			yield data
+
+def resample_data(data, rate, angle_columns=()):
+	return np.concatenate([np.empty((0, data.shape[1]))] + list(resample_chunks([data], rate, angle_columns)))
 
-	smooth_fdr_data = smooth_row_data(fdr_data, 4, sigma * 10) # smooth the new speed data (apply a strong smooth to speed data because, speed is generated with erroneous data: deffirence between erroneous close values)
+#####
+# Manage FDR format
+def compute_fdr_data(data, previous_row, previous_time, first_index, previous_distance=0.0):
+	# previous_row is the last row before data (data[0] itself at the beginning of the flight)
+	if previous_row is None:
+		previous_row = data[0]
+	points = np.concatenate((previous_row[np.newaxis, :], data))
+
+	fdr_data = np.empty((len(data), len(fdr_fields)), order='F')
+
+	# Time since the first row
+	times = np.cumsum(np.concatenate(([previous_time], np.diff(points[:, 0]))))
+	fdr_data[:, 0] = times[1:]
+
+	time_chng = np.diff(times) / time_factor
+	suspects = np.flatnonzero(time_chng == 0.0) # None when the data are resampled
+	if len(suspects) > 0:
+		for index in suspects:
+			if first_index + index != 0:
+				eprint("Warning: suspect time at index " + str(first_index + index) + " !")
+		time_chng[suspects] = 0.0000000001
+
+	# Speed from the distance to the previous position
+	d = great_circle(points[:-1].T, points[1:].T)
+	fdr_data[:, 4] = (d / np.abs(time_chng)) / 0.51444444
+	fdr_data[:, 8] = np.cumsum(np.concatenate(([previous_distance], d)))[1:]
+
+	fdr_data[:, 1:4] = data[:, 1:4] # lon, lat, alt
+	fdr_data[:, 5] = data[:, 6] # bearing = yaw
+	fdr_data[:, 6] = data[:, 5] # pitch
+	fdr_data[:, 7] = data[:, 4] # roll
+	return fdr_data
+
+def to_fdr(data, sigma, window=0):
+	fdr_data = compute_fdr_data(data, None, 0.0, 0) if len(data) > 0 else np.empty((0, len(fdr_fields)))
+	smooth_fdr_data = smooth_columns(fdr_data, *column_filters([4], sigma * 10, window * 10)) # smooth the new speed data (apply a strong smooth to speed data because, speed is generated with erroneous data: deffirence between erroneous close values)
 	return smooth_fdr_data
 
+class FdrTransform:
+	# FDR rows of the chunks of smoothed data, following the rows of the previous chunks
+	def __init__(self):
+		self.previous_row = None
+		self.previous_time = 0.0
+		self.previous_distance = 0.0
+		self.index = 0
+
+	def feed(self, data):
+		fdr_data = compute_fdr_data(data, self.previous_row, self.previous_time, self.index, self.previous_distance)
+		self.previous_row = data[-1].copy()
+		self.previous_time = fdr_data[-1, 0]
+		self.previous_distance = fdr_data[-1, 8]
+		self.index += len(data)
+		return fdr_data
+
+def fdr_chunks(chunks):
+	transform = FdrTransform()
+	for data in chunks:
+		yield transform.feed(data)
+
 def print_flight_info(fdr_data, flight_feature):
-	global time_factor
+	print_flight_summary(flight_feature, fdr_data[-1, 8], fdr_data[-1, 0])
+
+def print_flight_summary(flight_feature, path_length, flight_time):
 	print str(flight_feature) + '\n'
 
-	path_length, segment_list = get_path_length(fdr_data)
 	print 'Flight path distance: ' + '{0:.3f}'.format(path_length / 1000.0) + ' km'
 
-	m, s = divmod(fdr_data[len(fdr_data) - 1][0] / time_factor, 60)
+	m, s = divmod(flight_time / time_factor, 60)
 	h, m = divmod(m, 60)
 	print "Flight time: %d:%02d:%02d" % (h, m, s)
 
 #####
 # Export function to different formats
-def write_french_csv(data, header, file):
-	csvfile = open(file, 'wb')
-	csvfile.write(header + '\n')
+def write_french_csv_rows(csvfile, data):
 	for row in data:
 		for num in row:
 			csvfile.write(str(num).replace('.', ',') + ';')
 		csvfile.write('\n')
-	csvfile.close()
-
-def write_kml(data, kml_file):
-	global time_factor
-
-	(mdir, mfilename) = os.path.split(kml_file)
-	(mnam, mext) = os.path.splitext(mfilename)
-
-	coord_str = ''
-	tag_str = ''
-	_time = 0.0
-	for index, row in enumerate(data):
-		lonlatalt_str = str(row[1]) + ',' + str(row[2]) + ',' + str(int(float(row[3]) / 3.28084)) # Converted to meters instead of feet
-		lnstr = lonlatalt_str + '\n'
-		coord_str +=  lnstr
-		if (row[0] >= _time):
-			converted_time1 = time.strftime('%H:%M', time.localtime(row[0] / time_factor))
-			converted_time2 = time.strftime('%H:%M:%S %d/%m/%Y', time.localtime(row[0] / time_factor))
-			tagstr = '<Placemark>\n<name>' + converted_time1 + '</name>\n<description>' + converted_time2 + '</description>\n'
+
+def write_french_csv(data, header, file):
+	csvfile, owned = open_output(file)
+	csvfile.write(header + '\n')
+	write_french_csv_rows(csvfile, data)
+	if owned:
+		csvfile.close()
+
+class KmlWriter:
+	# tolerance (meters) enables the decimation of the path, track writes a gx:Track with the time of each point,
+	# name is the one of the file by default
+	def __init__(self, kml_file, tolerance=0.0, track=False, name=None):
+		if name is None:
+			name = file_flight_name(kml_file)
+		mnam = escape(name)
+
+		self.tolerance = tolerance
+		self.track = track
+		self.tags = []
+		self._time = 0.0
+
+		self.f, self.owned = open_output(kml_file)
+		self.f.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+		if track:
+			self.f.write("<kml xmlns='http://www.opengis.net/kml/2.2' xmlns:gx='http://www.google.com/kml/ext/2.2'>\n")
+		else:
+			self.f.write("<kml xmlns='http://earth.google.com/kml/2.1'>\n")
+		self.f.write("<Document>\n")
+		self.f.write("	<name>" + mnam + '.kml' +"</name>\n")
+		self.f.write("	<Placemark>\n")
+		self.f.write("		<name>" + mnam + "</name>\n")
+		self.f.write("		<description>spline path</description>\n")
+		if track:
+			self.f.write("		<gx:Track>\n")
+			self.f.write("			<altitudeMode>absolute</altitudeMode>\n")
+			self.coords = tempfile.TemporaryFile() # All the gx:coord elements come after all the when elements
+		else:
+			self.f.write("		<LineString>\n")
+			self.f.write("			<tessellate>1</tessellate>\n")
+			self.f.write("			<altitudeMode>absolute</altitudeMode>\n")
+			self.f.write("			<coordinates>")
+
+	def __getstate__(self):
+		# Saved by the incremental mode with the offset of the file instead of the file
+		state = self.__dict__.copy()
+		state['f'] = self.f.tell()
+		return state
+
+	def tag_indices(self, times):
+		# A tag is added on the first row of each minute of the flight
+		indices = []
+		if np.all(np.diff(times) >= 0): # Sorted times: jump directly to the next tagged row
+			index = np.searchsorted(times, self._time)
+			while index < len(times):
+				indices.append(index)
+				self._time = times[index] + 60000.0 if self._time == 0.0 else self._time + 60000.0
+				index += 1 + np.searchsorted(times[index + 1:], self._time)
+		else:
+			for index, value in enumerate(times.tolist()):
+				if (value >= self._time):
+					indices.append(index)
+					self._time = value + 60000.0 if self._time == 0.0 else self._time + 60000.0
+		return indices
+
+	def write(self, data):
+		for index in self.tag_indices(data[:, 0]):
+			row = data[index]
+			lonlatalt_str = '%r,%r,%d' % (float(row[1]), float(row[2]), row[3] / 3.28084) # Converted to meters instead of feet
+			local_time = time.localtime(row[0] / time_factor)
+			tagstr = '<Placemark>\n<name>' + escape(time.strftime('%H:%M', local_time)) + '</name>\n<description>' + escape(time.strftime('%H:%M:%S %d/%m/%Y', local_time)) + '</description>\n'
 			tagstr += '<Point><coordinates>' + lonlatalt_str + '</coordinates></Point>\n</Placemark>\n'
-			tag_str += tagstr
-			if _time == 0.0:
-				_time = row[0] + 60000.0
+			self.tags.append(tagstr)
+
+		if self.tolerance > 0.0:
+			data = data[douglas_peucker(data, self.tolerance)]
+		# Formatted and written by blocks of rows like the FDR lines, to bound the memory of long flights
+		for start in range(0, len(data), fdr_block_size):
+			block = data[start:start + fdr_block_size]
+			coords = np.column_stack((block[:, 1], block[:, 2], block[:, 3] / 3.28084)).ravel().tolist() # Altitude converted to meters instead of feet
+			if self.track:
+				whens = np.datetime_as_string(np.round(block[:, 0]).astype(np.int64).astype('datetime64[ms]'), timezone='UTC').tolist()
+				self.f.write(('			<when>%s</when>\n' * len(block)) % tuple(whens))
+				self.coords.write(('			<gx:coord>%r %r %d</gx:coord>\n' * len(block)) % tuple(coords))
 			else:
-				_time += 60000.0
-
-	f = open(kml_file, 'wb')
-	f.write("<?xml version='1.0' encoding='UTF-8'?>\n")
-	f.write("<kml xmlns='http://earth.google.com/kml/2.1'>\n")
-	f.write("<Document>\n")
-	f.write("	<name>" + mnam + '.kml' +"</name>\n")
-	f.write("	<Placemark>\n")
-	f.write("		<name>" + mnam + "</name>\n")
-	f.write("		<description>spline path</description>\n")
-	f.write("		<LineString>\n")
-	f.write("			<tessellate>1</tessellate>\n")
-	f.write("			<altitudeMode>absolute</altitudeMode>\n")
-	f.write("			<coordinates>" + coord_str + "</coordinates>\n")
-	f.write("		</LineString>\n")
-	f.write("	</Placemark>\n")
-
-	f.write("   <Folder>\n")
-	f.write("      <name>Tags</name>\n")
-	f.write("      <description>Tags added during the flight.</description>\n")
-	f.write(tag_str)
-	f.write("   </Folder>\n")
-
-	f.write("</Document>\n")
-	f.write("</kml>\n")
-	f.close()
-
-def write_fdr(data, flight_feature, fdr_file):
-	(mdir, mfilename) = os.path.split(fdr_file)
-	(mnam, mext) = os.path.splitext(mfilename)
-
-	output = []
-	f = open(fdr_file, 'wb')
-	f.write('A' + '\n')
-	f.write('2' + '\n')
-	f.write('\n')
-	f.write('COMM,Pilot=' +  flight_feature.pilot + ',\n')
-	f.write('COMM,Location=' +  flight_feature.location + ',\n')
-	f.write('TAIL,' + flight_feature.registration + ',\n')
-	f.write('DATE,' + flight_feature.date + ',\n')
-	f.write('PRES,29.83,\n')
-	f.write('TEMP,65,\n')
-	f.write('WIND,230,16,\n')
-	f.write('TIME,' + flight_feature.time + '\n')
-	f.write('\n')
-
-	# Roll factor, set to 10 or so for small UAVs or RC models
-	rf = 1.0
-	
-	for index, row in enumerate(data):
-		t_str = '{0:.3f}'.format(convert_time(row[0]))
-		lonstr = '{0:.6f}'.format(row[1])
-		latstr = '{0:.6f}'.format(row[2])
-		elevstr = str(int(row[3])) # * 3.28084
-		pitchstr = '{0:.2f}'.format(row[6])
-		rollstr = '{0:.2f}'.format(row[7] * rf)
-		hdgstr = '{0:.2f}'.format(row[5])
-		kias_str = '{0:.2f}'.format(row[4]) # * 1.94384449
-		ailDefl = '{0:.2f}'.format((row[7] / 90.0) * 0.3)
-		elevDefl = '{0:.2f}'.format((row[6] / 90.0) * 0.3)
-
-		if index == 0:
-			pitchstr = '{0:.2f}'.format(data[2][6])
-			rollstr = '{0:.2f}'.format(data[3][7] * rf)
-			hdgstr = '{0:.2f}'.format(data[2][5])
-			ailDefl = '{0:.2f}'.format((data[3][7] / 90.0) * 0.3) 
-			elevDefl = '{0:.2f}'.format((data[2][6] / 90.0) * 0.3)
-
-		if index == 1:
-			rollstr = '{0:.2f}'.format(data[3][7] * rf)
-			ailDefl = '{0:.2f}'.format((data[3][7] / 90.0) * 0.3) 
-
-		f.write('DATA,' + t_str + ',25,' + lonstr + ',' + latstr + ',' + elevstr + ', 0,' + ailDefl + ',' + elevDefl + ',0,' + pitchstr + ',' + rollstr + ',' + hdgstr + ',' + kias_str + ',0,0,0,0.5,20,0, 0,0,0,0,0,0,0,0,0, 11010,10930,4,4,90, 270,0,0,10,10,1,1,10,10,0,0,0,0,10,10, 0,0,0,0,0,0,0,0,0,0,500, 29.92,0,0,0,0,0,0, 1,1,0,0, 2000,2000,0,0, 2000,2000,0,0, 30,30,0,0, 100,100,0,0, 100,100,0,0, 0,0,0,0, 0,0,0,0, 1500,1500,0,0, 400,400,0,0, 1000,1000,0,0, 1000,1000,0,0, 0,0,0,0,' + '\n')
-		output.append([t_str, lonstr, latstr, elevstr, ailDefl, elevDefl, pitchstr, rollstr, hdgstr, kias_str])
-
-	f.close()
+				self.f.write(('%r,%r,%d\n' * len(block)) % tuple(coords))
+
+	def close(self):
+		if self.track:
+			self.coords.seek(0)
+			shutil.copyfileobj(self.coords, self.f)
+			self.coords.close()
+			self.f.write("		</gx:Track>\n")
+		else:
+			self.f.write("</coordinates>\n")
+			self.f.write("		</LineString>\n")
+		self.f.write("	</Placemark>\n")
+
+		self.f.write("   <Folder>\n")
+		self.f.write("      <name>Tags</name>\n")
+		self.f.write("      <description>Tags added during the flight.</description>\n")
+		self.f.write(''.join(self.tags))
+		self.f.write("   </Folder>\n")
+
+		self.f.write("</Document>\n")
+		self.f.write("</kml>\n")
+		if self.owned:
+			self.f.close()
+
+def write_kml(data, kml_file, tolerance=0.0, track=False, name=None):
+	kml = KmlWriter(kml_file, tolerance, track, name)
+	kml.write(data)
+	kml.close()
+
+class FdrWriter:
+	def __init__(self, flight_feature, fdr_file, debug=False):
+		self.flight_feature = flight_feature
+		self.debug = debug # Give back the written values to check them
+		self.pending = None # First rows are kept until rows 2 and 3 (used to write rows 0 and 1) are known
+		self.nb_rows = 0
+		self.start_time = None # Time of the first row, FDR times start from it
+		self.f, self.owned = open_output(fdr_file)
+
+	def __getstate__(self):
+		# Saved by the incremental mode with the offset of the file instead of the file
+		state = self.__dict__.copy()
+		state['f'] = self.f.tell()
+		return state
+
+	def write_header(self):
+		flight_feature = self.flight_feature
+		f = self.f
+		f.write('A' + '\n')
+		f.write('2' + '\n')
+		f.write('\n')
+		f.write('COMM,Pilot=' +  flight_feature.pilot + ',\n')
+		f.write('COMM,Location=' +  flight_feature.location + ',\n')
+		f.write('TAIL,' + flight_feature.registration + ',\n')
+		f.write('DATE,' + flight_feature.date + ',\n')
+		f.write('PRES,29.83,\n')
+		f.write('TEMP,65,\n')
+		f.write('WIND,230,16,\n')
+		f.write('TIME,' + flight_feature.time + '\n')
+		f.write('\n')
+
+	def write(self, data):
+		if self.nb_rows == 0:
+			self.pending = data if self.pending is None else np.concatenate((self.pending, data))
+			if len(self.pending) < 4:
+				return []
+			data = self.pending
+			self.pending = None
+		return self.write_rows(data)
+
+	def write_rows(self, data):
+		if len(data) == 0:
+			return []
+		if self.nb_rows == 0:
+			self.write_header()
+			self.first_rows = data[np.minimum(np.arange(4), len(data) - 1)] # Last row repeated for flights of less than 4 rows
+		if self.start_time is None:
+			self.start_time = float(data[0, 0])
+
+		# Roll factor, set to 10 or so for small UAVs or RC models
+		rf = 1.0
+
+		pitch = data[:, 6].copy()
+		roll = data[:, 7].copy()
+		hdg = data[:, 5].copy()
+		if self.nb_rows == 0:
+			pitch[0] = self.first_rows[2][6]
+			roll[0] = self.first_rows[3][7]
+			hdg[0] = self.first_rows[2][5]
+			if len(data) > 1:
+				roll[1] = self.first_rows[3][7]
+
+		table = np.column_stack((convert_time(data[:, 0], self.start_time), data[:, 1], data[:, 2], data[:, 3], (roll / 90.0) * 0.3, (pitch / 90.0) * 0.3, pitch, roll * rf, hdg, data[:, 4]))
+		output = []
+		for start in range(0, len(table), fdr_block_size):
+			block = table[start:start + fdr_block_size]
+			lines = (fdr_data_format * len(block)) % tuple(block.ravel().tolist())
+			self.f.write(lines)
+			if self.debug:
+				get_values = operator.itemgetter(1, 3, 4, 5, 7, 8, 10, 11, 12, 13)
+				output.extend(get_values(line.split(',', 14)) for line in lines.splitlines())
+		self.nb_rows += len(data)
+		return output
+
+	def close(self):
+		output = []
+		if self.pending is not None: # Less than 4 rows in the whole flight
+			output = self.write_rows(self.pending)
+		if self.owned:
+			self.f.close()
+		return output
+
+def write_fdr(data, flight_feature, fdr_file, debug=False):
+	fdr = FdrWriter(flight_feature, fdr_file, debug)
+	output = fdr.write(data)
+	output += fdr.close()
 	return output
 
 #####
@@ -412,34 +1502,482 @@ def find_label_index(format, label):
 			return index
 	return -1
 
-def plot_2Dfigure(data, format, color, output, output_prefix, x_axis, y_axis):
-	mat = list(zip(*data))
-
+def minmax_indices(x_values, y_values, nb_buckets):
+	# Indices of the points to draw: the extreme values of x and y in each bucket of consecutive points
+	# (the figure looks the same as with all the points when there are more points than pixels)
+	if len(x_values) <= 4 * nb_buckets:
+		return np.arange(len(x_values))
+	size = len(x_values) // nb_buckets
+	end = size * nb_buckets
+	starts = np.arange(0, end, size)
+	indices = [np.array([0, len(x_values) - 1]), np.arange(end, len(x_values))]
+	for values in (x_values, y_values):
+		buckets = values[:end].reshape(nb_buckets, size)
+		indices.append(starts + buckets.argmin(axis=1))
+		indices.append(starts + buckets.argmax(axis=1))
+	return np.unique(np.concatenate(indices))
+
+def prepare_2Dfigure(data, format, color, output, output_prefix, x_axis, y_axis):
 	x_index = find_label_index(format, x_axis)
 	y_index = find_label_index(format, y_axis)
 	if (x_index == -1) or (y_index == -1): # if one of the parameter if not found, exit function
 		eprint("Warning: one of the parameter (" + x_axis + ", " + y_axis + ") not found")
-		return
-	x_values = mat[x_index]
-	y_values = mat[y_index]
+		return None
+	x_values = data[:, x_index]
+	y_values = data[:, y_index]
+	indices = minmax_indices(x_values, y_values, plot_resolution)
 
 	output_file = output_filename(output, 'plot' + output_prefix + '_', '_' + str(x_axis) + '_' + str(y_axis) + '.png')
-	plot.xlabel(x_axis)
-	plot.ylabel(y_axis)
-	plot.title(str(x_axis) + '_' + str(y_axis))
-	plot.plot(x_values, y_values, color)
-	plot.axis( [ min(x_values), max(x_values), min(y_values), max(y_values) ] )
-	#plot.show()
-	plot.savefig(output_file)
-	plot.clf()
-
-def plot_figures(data, format, color, output, output_prefix):
-	plot_2Dfigure(data, format, color, output, output_prefix, 'Lon', 'Lat')
-	plot_2Dfigure(data, format, color, output, output_prefix, 'Time', 'Alt')
-	plot_2Dfigure(data, format, color, output, output_prefix, 'Time', 'Speed')
-	plot_2Dfigure(data, format, color, output, output_prefix, 'Time', 'Pitch')
-	plot_2Dfigure(data, format, color, output, output_prefix, 'Time', 'Roll')
-	plot_2Dfigure(data, format, color, output, output_prefix, 'Time', 'Bearing')
+	axis = [x_values.min(), x_values.max(), y_values.min(), y_values.max()]
+	return (x_values[indices], y_values[indices], axis, color, x_axis, y_axis, output_file)
+
+def prepare_figures(data, format, color, output, output_prefix):
+	# Decimated values of each figure, rendered later by a FigurePlotter
+	figures = []
+	for x_axis, y_axis in [('Lon', 'Lat'), ('Time', 'Alt'), ('Time', 'Speed'), ('Time', 'Pitch'), ('Time', 'Roll'), ('Time', 'Bearing')]:
+		figure = prepare_2Dfigure(data, format, color, output, output_prefix, x_axis, y_axis)
+		if figure is not None:
+			figures.append(figure)
+	return figures
+
+def make_2Dfigure(figure):
+	from matplotlib.figure import Figure
+	from matplotlib.backends.backend_agg import FigureCanvasAgg
+	(x_values, y_values, axis, color, x_axis, y_axis, output_file) = figure
+	fig = Figure()
+	FigureCanvasAgg(fig)
+	ax = fig.add_subplot(111)
+	ax.set_xlabel(x_axis)
+	ax.set_ylabel(y_axis)
+	ax.set_title(str(x_axis) + '_' + str(y_axis))
+	ax.plot(x_values, y_values, color)
+	ax.axis(axis)
+	return fig
+
+def render_2Dfigure(figure):
+	make_2Dfigure(figure).savefig(figure[-1])
+
+class FigurePlotter:
+	# Figures are rendered in worker processes while the conversion goes on, or written as the pages
+	# of a single pdf file
+	def __init__(self, pdf_file=None):
+		self.pdf = None
+		if pdf_file:
+			from matplotlib.backends.backend_pdf import PdfPages
+			self.pdf = PdfPages(pdf_file)
+		self.pool = None
+		self.results = []
+		# Batch workers are daemon processes which can't have their own workers
+		if (self.pdf is None) and (multiprocessing.cpu_count() > 1) and not multiprocessing.current_process().daemon:
+			self.pool = multiprocessing.Pool(min(multiprocessing.cpu_count(), 6))
+
+	def plot(self, figures):
+		if self.pdf is not None:
+			for figure in figures:
+				self.pdf.savefig(make_2Dfigure(figure))
+		elif self.pool is not None:
+			self.results.append(self.pool.map_async(render_2Dfigure, figures))
+		else:
+			for figure in figures:
+				render_2Dfigure(figure)
+
+	def close(self):
+		if self.pdf is not None:
+			self.pdf.close()
+		if self.pool is not None:
+			self.pool.close()
+			self.pool.join()
+			for result in self.results:
+				result.get() # Raise the errors of the workers
+
+#####
+# Streaming conversion (data are read, transformed and written by chunks to use a bounded memory)
+def written_chunks(chunks, write):
+	for data in chunks:
+		write(data)
+		yield data
+
+def open_french_csv(header, file):
+	csvfile, owned = open_output(file)
+	csvfile.write(header + '\n')
+	return csvfile
+
+def convert_stream(input_file, output, options, stats=None):
+	default_format = 'Time;Lon;Lat;Alt;Roll;Pitch;Yaw'
+	flight_feature = FlightFeature()
+	debug_files = []
+
+	# Raw data
+	chunks = stage_chunks(stats, 'parse', lambda chunks: load_flight_chunks(input_file, options, flight_feature), None)
+	if options.binary:
+		binary = BinaryWriter(flight_feature, output_filename(output, '', '.tofdr'))
+		chunks = stage_chunks(stats, 'binary', functools.partial(written_chunks, write=binary.write), chunks)
+	if options.debug:
+		debug_files.append(open_french_csv(default_format, output_filename(output, '', '_raw.csv')))
+		chunks = stage_chunks(stats, 'debug csv', functools.partial(written_chunks, write=functools.partial(write_french_csv_rows, debug_files[-1])), chunks)
+
+	# fix data
+	chunks = stage_chunks(stats, 'fix', lambda chunks: (fix_raw_data(data, options.fix_param) for data in chunks), chunks)
+	if options.debug:
+		debug_files.append(open_french_csv(default_format, output_filename(output, '', '_fixed.csv')))
+		chunks = stage_chunks(stats, 'debug csv', functools.partial(written_chunks, write=functools.partial(write_french_csv_rows, debug_files[-1])), chunks)
+
+	# Smooth data
+	chunks = stage_chunks(stats, 'smooth', lambda chunks: smooth_chunks(chunks, *column_filters(range(len(fields_dest)), options.sigma, options.window), angle_columns=raw_angle_columns), chunks)
+	if options.debug:
+		debug_files.append(open_french_csv(default_format, output_filename(output, '', '_smooth.csv')))
+		chunks = stage_chunks(stats, 'debug csv', functools.partial(written_chunks, write=functools.partial(write_french_csv_rows, debug_files[-1])), chunks)
+
+	# Export data to KML format
+	kml = KmlWriter(output_filename(output, '', '.kml'), options.kml_tolerance, options.kml_track)
+	chunks = stage_chunks(stats, 'kml', functools.partial(written_chunks, write=kml.write), chunks)
+
+	# Resample data on a uniform time grid
+	if options.rate > 0:
+		chunks = stage_chunks(stats, 'resample', lambda chunks: resample_chunks(chunks, options.rate, raw_angle_columns), chunks)
+		if options.debug:
+			debug_files.append(open_french_csv(default_format, output_filename(output, '', '_resampled.csv')))
+			chunks = stage_chunks(stats, 'debug csv', functools.partial(written_chunks, write=functools.partial(write_french_csv_rows, debug_files[-1])), chunks)
+
+	# Transform to FDR format (create new data, like speed, from existing ones)
+	chunks = stage_chunks(stats, 'fdr transform', lambda chunks: smooth_chunks(fdr_chunks(chunks), *column_filters([4], options.sigma * 10, options.window * 10)), chunks)
+	if options.debug:
+		debug_files.append(open_french_csv(fdr_format, output_filename(output, '', '_fdr.csv')))
+		chunks = stage_chunks(stats, 'debug csv', functools.partial(written_chunks, write=functools.partial(write_french_csv_rows, debug_files[-1])), chunks)
+
+	# Keep one row of FDR data every fdr_distance meters of the path
+	if options.fdr_distance > 0:
+		chunks = stage_chunks(stats, 'decimate', lambda chunks: decimate_chunks(chunks, options.fdr_distance), chunks)
+
+	# Write FDR data to file an export it to csv to verify what as been really written
+	fdr = FdrWriter(flight_feature, output_filename(output, '', '.fdr'), options.debug)
+	if options.debug:
+		written_file = open_french_csv('TIME;LONG;LAT;ALT;AILDEFL;ELEVDEFL;PITCH;ROLL;HEADING;SPEED', output_filename(output, '', '_written.csv'))
+		debug_files.append(written_file)
+	total_rows = 0
+	last_row = None
+	for fdr_data in chunks:
+		total_rows += len(fdr_data)
+		written_data = run_stage(stats, 'fdr write', fdr.write, fdr_data)
+		if options.debug:
+			run_stage(stats, 'debug csv', write_french_csv_rows, written_file, written_data)
+		last_row = fdr_data[-1].copy()
+	written_data = run_stage(stats, 'fdr write', fdr.close)
+	if options.debug:
+		run_stage(stats, 'debug csv', write_french_csv_rows, written_file, written_data)
+	run_stage(stats, 'kml', kml.close)
+	if options.binary:
+		run_stage(stats, 'binary', binary.close)
+	for csvfile in debug_files:
+		csvfile.close()
+	if total_rows == 0:
+		raise ValueError("no valid data found in " + input_file)
+
+	# Print information about flight
+	if options.info and (last_row is not None):
+		print_flight_info(last_row[np.newaxis, :], flight_feature)
+
+#####
+# Incremental conversion of growing logs: the state of the conversion is saved with the outputs, so that
+# the next conversion only parses the lines appended to the log. The last rows, smoothed without the
+# next ones, are written again (the FDR and KML files are truncated before them).
+incremental_version = '1' # Change it when the saved state changes
+
+class AppendedLines:
+	# Complete lines of a file from offset: a line still being written is left for the next conversion
+	def __init__(self, ifile, offset):
+		self.ifile = ifile
+		self.offset = offset
+		ifile.seek(offset)
+
+	def __iter__(self):
+		return self
+
+	def next(self):
+		line = self.ifile.readline()
+		if not line.endswith('\n'):
+			raise StopIteration
+		self.offset += len(line)
+		return line
+
+class IncrementalConversion:
+	def __init__(self, output, options, key):
+		self.key = key # Options of the conversion (outputs converted with other ones are not continued)
+		self.offset = 0 # Offset of the end of the last line parsed
+		self.fingerprint = None # Hash of the beginning of the log, to detect another log with the same name
+		self.flight_feature = FlightFeature()
+		self.smoother = ChunkSmoother(*column_filters(range(len(fields_dest)), options.sigma, options.window), angle_columns=raw_angle_columns)
+		self.resampler = Resampler(options.rate, raw_angle_columns) if options.rate > 0 else None
+		self.transform = FdrTransform()
+		self.speed_smoother = ChunkSmoother(*column_filters([4], options.sigma * 10, options.window * 10))
+		self.decimator = DistanceDecimator(options.fdr_distance) if options.fdr_distance > 0 else None
+		self.kml_file = output_filename(output, '', '.kml')
+		self.fdr_file = output_filename(output, '', '.fdr')
+		self.kml = KmlWriter(self.kml_file, options.kml_tolerance)
+		self.fdr = FdrWriter(self.flight_feature, self.fdr_file)
+		self.last_row = None # Last FDR row written
+
+	def write(self, data):
+		self.write_smoothed(self.smoother.feed(data))
+
+	def write_smoothed(self, data, end=False):
+		if len(data) > 0:
+			self.kml.write(data)
+			if self.resampler is not None:
+				data = self.resampler.feed(data)
+		if len(data) > 0:
+			self.write_fdr(self.speed_smoother.feed(self.transform.feed(data)))
+		if end:
+			self.write_fdr(self.speed_smoother.flush(), True)
+
+	def write_fdr(self, fdr_data, end=False):
+		if self.decimator is not None:
+			fdr_data = self.decimator.feed(fdr_data)
+			if end:
+				fdr_data = np.concatenate((fdr_data, self.decimator.flush()))
+		if len(fdr_data) > 0:
+			self.fdr.write(fdr_data)
+			self.last_row = fdr_data[-1].copy()
+
+	def close(self):
+		# The last rows are smoothed without the next ones, the files are ended
+		self.write_smoothed(self.smoother.flush(), True)
+		self.fdr.close()
+		self.kml.close()
+
+def log_fingerprint(input_file, offset):
+	with open(input_file, 'rb') as ifile:
+		return hashlib.sha1(ifile.read(min(offset, 4096))).hexdigest()
+
+def incremental_key(options, layout):
+	return repr((incremental_version, layout.name, options.sigma, options.window, options.rate, options.fdr_distance, options.start_time, options.stop_time, options.kml_tolerance, str(options.fix_param)))
+
+def load_incremental(input_file, state_file, key):
+	# Saved conversion if it can be continued: same options, same beginning of the log and outputs not
+	# truncated since (None otherwise, the log is converted from its beginning)
+	try:
+		with open(state_file, 'rb') as f:
+			conversion = cPickle.load(f)
+	except (IOError, OSError, EOFError, cPickle.UnpicklingError, AttributeError, ImportError):
+		return None
+	if (conversion.key != key) or (os.path.getsize(input_file) < conversion.offset) or (log_fingerprint(input_file, conversion.offset) != conversion.fingerprint):
+		return None
+	for writer, filename in ((conversion.kml, conversion.kml_file), (conversion.fdr, conversion.fdr_file)):
+		if not os.path.isfile(filename) or (os.path.getsize(filename) < writer.f):
+			return None
+	# Outputs truncated after the last final rows (offsets of the saved writers)
+	for writer, filename in ((conversion.kml, conversion.kml_file), (conversion.fdr, conversion.fdr_file)):
+		offset = writer.f
+		writer.f = open(filename, 'r+b')
+		writer.f.seek(offset)
+		writer.f.truncate()
+	return conversion
+
+def save_incremental(conversion, state_file):
+	# Written to a temporary file renamed at the end, like the cache
+	state = tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(state_file)), suffix='.tmp', delete=False)
+	cPickle.dump(conversion, state, cPickle.HIGHEST_PROTOCOL)
+	state.close()
+	replace_file(state.name, state_file)
+
+def complete_header(input_file, layout):
+	# Whether the header lines of a growing log are all written (nothing is converted nor saved before)
+	with open(input_file, 'rb') as ifile:
+		return all(ifile.readline().endswith('\n') for index in range(layout.header_lines))
+
+def convert_incremental(input_file, output, options, stats=None):
+	reader = find_reader(input_file, options.reader)
+	if (reader.layout is None) or (input_extension(input_file) != os.path.splitext(input_file.lower())[1]):
+		raise ValueError("incremental conversion needs an uncompressed csv log: " + input_file)
+	for enabled, message in ((options.plotting, "figures are not generated"), (options.debug, "debug files are not generated"), (options.binary, "binary file is not written"), (options.kml_track, "KML path is not written as a track"), (options.split, "flights are not split")):
+		if enabled:
+			eprint("Warning: " + message + " in incremental mode !")
+	state_file = output_filename(output, '', '.state')
+	key = incremental_key(options, reader.layout)
+	conversion = run_stage(stats, 'resume', load_incremental, input_file, state_file, key)
+	if conversion is None: # First conversion of the log
+		if not complete_header(input_file, reader.layout):
+			eprint("Warning: no valid data found in " + input_file + " yet")
+			return
+		conversion = IncrementalConversion(output, options, key)
+
+	with open(input_file, 'rb') as ifile:
+		if conversion.offset == 0:
+			reader.layout.read_header(ifile, conversion.flight_feature)
+			if options.start_time > 0:
+				seek_start_time(ifile, options.start_time, reader.layout)
+			conversion.offset = ifile.tell()
+		lines = AppendedLines(ifile, conversion.offset)
+		chunks = stage_chunks(stats, 'parse', lambda chunks: read_flight_chunks(lines, options.start_time, options.stop_time, conversion.flight_feature, fields_dest, reader.layout), None)
+		for data in chunks:
+			run_stage(stats, 'convert', conversion.write, fix_raw_data(data, options.fix_param))
+	conversion.offset = lines.offset
+	conversion.fingerprint = log_fingerprint(input_file, conversion.offset)
+
+	# Saved before the last rows are written, they are written again with the next lines of the log
+	run_stage(stats, 'save', save_incremental, conversion, state_file)
+	run_stage(stats, 'convert', conversion.close)
+	if conversion.last_row is None:
+		eprint("Warning: no valid data found in " + input_file + " yet")
+	elif options.info:
+		print_flight_info(conversion.last_row[np.newaxis, :], conversion.flight_feature)
+
+#####
+# Segmentation of a log holding several flights (the logger left on between them): the aircraft is in the
+# air when its ground speed or its altitude changes, and the phase column of Flight Recorder 24 logs (when
+# present) tells the rows logged on the ground. The logs are also cut where rows are missing for long.
+ground_climb = 300.0 # Vertical speed (feet per minute) over which the aircraft is in the air
+speed_time = 5.0 # Half width (seconds) of the time window of the ground and vertical speeds
+min_flight_time = 60.0 # Seconds in the air of a flight (shorter ones are fast taxiing)
+min_ground_time = 60.0 # Seconds on the ground between two flights (shorter stops are touch-and-go)
+flight_margin = 30.0 # Seconds on the ground kept before the take off and after the landing
+ground_phases = [0] # Values of the phase column logged on the ground
+segment_fields = fields_dest + ['phase']
+
+def time_window_rate(times, values, half_width):
+	# Rate of change (per second) of values between half_width seconds before and after each row
+	before = np.searchsorted(times, times - half_width * time_factor, 'left')
+	after = np.searchsorted(times, times + half_width * time_factor, 'right') - 1
+	duration = (times[after] - times[before]) / time_factor
+	with np.errstate(divide='ignore', invalid='ignore'):
+		return np.where(duration > 0, (values[after] - values[before]) / duration, 0.0)
+
+def load_segmented_flight(input_file, options):
+	# Data of the flights and their phases (None if the log has no phase column): the phase column is
+	# parsed with the other ones, so such logs are not read from the cache which only has fields_dest
+	reader = find_reader(input_file, options.reader)
+	if (reader.layout is None) or ('phase' not in reader.layout.fields):
+		data, ff = load_flight(input_file, options)
+		return data, None, ff
+	ff = FlightFeature()
+	# Rows with an invalid phase are kept (their phase is NaN)
+	chunks = list(read_flight_file_chunks(input_file, options.start_time, options.stop_time, ff, segment_fields, reader.layout, len(fields_dest)))
+	output = np.empty((sum(len(data) for data in chunks), len(segment_fields)), order='F')
+	if chunks:
+		np.concatenate(chunks, out=output)
+	return np.asfortranarray(output[:, :len(fields_dest)]), output[:, -1], ff
+
+def airborne_rows(data, phases, ground_speed):
+	# Whether the aircraft is in the air at each row
+	times = data[:, 0]
+	distances = np.concatenate(([0.0], np.cumsum(great_circle(data[:-1].T, data[1:].T))))
+	speed = np.abs(time_window_rate(times, distances, speed_time)) / 0.514444 # knots
+	climb = np.abs(time_window_rate(times, data[:, 3], speed_time)) * 60.0 # feet per minute
+	airborne = (speed >= ground_speed) | (climb >= ground_climb)
+	if phases is not None:
+		airborne &= ~np.in1d(phases, ground_phases)
+	return airborne
+
+def flight_segments(data, phases, split_gap, ground_speed):
+	# (start, stop) rows of each flight of data, empty if the aircraft never flew
+	times = data[:, 0]
+	if len(data) < 2:
+		return [(0, len(data))]
+	if np.any(np.diff(times) < 0):
+		eprint("Warning: times of the log are not increasing, it is not split !")
+		return [(0, len(data))]
+	airborne = airborne_rows(data, phases, ground_speed)
+	bounds = np.concatenate(([0], np.flatnonzero(np.diff(times) > split_gap * time_factor) + 1, [len(data)]))
+	segments = []
+	for block_start, block_stop in zip(bounds[:-1], bounds[1:]):
+		# Periods in the air of the rows between two gaps, joined when the stop between them is short
+		changes = np.flatnonzero(np.diff(np.concatenate(([0], airborne[block_start:block_stop].astype(np.int8), [0])))) + block_start
+		periods = []
+		for start, stop in zip(changes[::2], changes[1::2]):
+			if periods and (times[start] - times[periods[-1][1] - 1] < min_ground_time * time_factor):
+				periods[-1][1] = stop
+			else:
+				periods.append([start, stop])
+		for start, stop in periods:
+			if times[stop - 1] - times[start] < min_flight_time * time_factor:
+				continue
+			first = max(np.searchsorted(times, times[start] - flight_margin * time_factor, 'left'), block_start)
+			if segments:
+				first = max(first, segments[-1][1])
+			last = min(np.searchsorted(times, times[stop - 1] + flight_margin * time_factor, 'right'), block_stop)
+			segments.append((int(first), int(last)))
+	return segments
+
+#####
+# Library API: a Pipeline converts flights in memory without global state, so that a process can convert
+# many flights (the command line is built on it). Stages work in place on the arrays of a Flight and
+# exports are written to a file name or object, or given back as a string.
+class Flight:
+	def __init__(self, data, flight_feature, name=default_flight_name):
+		self.data = data # Rows of fields_dest (raw, fixed then smoothed by the stages)
+		self.flight_feature = flight_feature
+		self.fdr_data = None # Rows of fdr_fields once derived
+		self.name = name # Name of the input file without its extensions (name of the KML document)
+
+class Pipeline:
+	def __init__(self, options=None, stats=None):
+		self.options = options or ConvertOptions()
+		self.stats = stats
+
+	def parse(self, input_file):
+		# input_file is a file name or a file object (the reader is options.reader or found from its name)
+		data, flight_feature = run_stage(self.stats, 'parse', load_flight, input_file, self.options)
+		if len(data) == 0:
+			raise ValueError("no valid data found in " + input_name(input_file))
+		return Flight(data, flight_feature, file_flight_name(input_file))
+
+	def flight(self, data, flight_feature=None, name=default_flight_name):
+		# Flight of rows already in memory (copied as the stages work in place)
+		return Flight(np.array(data, dtype=np.float64, order='F'), flight_feature or FlightFeature(), name)
+
+	def fix(self, flight):
+		flight.data = run_stage(self.stats, 'fix', fix_raw_data, flight.data, self.options.fix_param)
+		return flight
+
+	def smooth(self, flight):
+		flight.data = run_stage(self.stats, 'smooth', smooth_data, flight.data, self.options.sigma, self.options.window)
+		return flight
+
+	def resample(self, flight):
+		if self.options.rate > 0:
+			flight.data = run_stage(self.stats, 'resample', resample_data, flight.data, self.options.rate, raw_angle_columns)
+		return flight
+
+	def derive(self, flight):
+		flight.fdr_data = run_stage(self.stats, 'fdr transform', to_fdr, flight.data, self.options.sigma, self.options.window)
+		return flight
+
+	def decimate(self, flight):
+		if self.options.fdr_distance > 0:
+			flight.fdr_data = run_stage(self.stats, 'decimate', decimate_distance, flight.fdr_data, self.options.fdr_distance)
+		return flight
+
+	def time_at_distance(self, flight, distance):
+		# Seconds from the start of the flight when the aircraft has flown distance meters (derived flight)
+		return time_at_distance(flight.fdr_data, distance) / time_factor
+
+	def export(self, name, write, output_file, *args):
+		# Output written to output_file, or returned as a string without output_file
+		if output_file is not None:
+			return run_stage(self.stats, name, write, *args + (output_file,))
+		output = cStringIO.StringIO()
+		run_stage(self.stats, name, write, *args + (output,))
+		return output.getvalue()
+
+	def binary(self, flight, binary_file=None):
+		return self.export('binary', write_binary, binary_file, flight.data, flight.flight_feature)
+
+	def kml(self, flight, kml_file=None, name=None):
+		# The KML document is named after kml_file, or after the flight without a file name
+		if (name is None) and (file_flight_name(kml_file) == default_flight_name):
+			name = flight.name
+		return self.export('kml', lambda data, output: write_kml(data, output, self.options.kml_tolerance, self.options.kml_track, name), kml_file, flight.data)
+
+	def fdr(self, flight, fdr_file=None):
+		# With fdr_file, the values really written are given back (only with options.debug)
+		return self.export('fdr write', lambda data, ff, output: write_fdr(data, ff, output, self.options.debug), fdr_file, flight.fdr_data, flight.flight_feature)
+
+	def convert(self, input_file):
+		# All the stages of a conversion, the FDR and KML files are returned as strings
+		flight = self.smooth(self.fix(self.parse(input_file)))
+		kml = self.kml(flight, name=flight.name)
+		fdr = self.fdr(self.decimate(self.derive(self.resample(flight))))
+		return flight, fdr, kml
 
 #####
 # Main Program
@@ -449,25 +1987,102 @@ def output_filename(output_dir, filename_prefix, filename_suffix):
 
 def usage(fix_param):
 	print "Usage: " + sys.argv[0] + " -i FILE -o DIR [option]"
+	print "       " + sys.argv[0] + " -b SOURCE -o DIR [option]"
+	print "       " + sys.argv[0] + " --watch=INBOX -o DIR [option]"
 	print
 	print "flightrecorder24tofdr.py generates files in DIR from a flightrecorder24 log file"
 	print
 	print "Arguments:"
 	print "    -i, --input=FILE"
-	print "        Specify the input filename in csv format"
+	print "        Specify the input filename: Flight Recorder 24 csv log (default), GPX track"
+	print "        (.gpx), NMEA sentences (.nmea) or native binary file (.tofdr), optionally"
+	print "        compressed (.gz, .bz2)"
+	print "    -b, --batch=SOURCE"
+	print "        Convert several input files: SOURCE is a directory (all its input files),"
+	print "        a glob pattern (quoted), a single input file or a manifest file (with another"
+	print "        extension than the input files, e.g. .lst) listing one input file by line."
+	print "        Each flight is generated in a sub-directory of DIR named as its input file"
+	print "    --watch=INBOX"
+	print "        Run as a daemon converting the input files added to the INBOX directory as"
+	print "        soon as they are complete (same sub-directories of DIR as batch mode). Files"
+	print "        whose FDR file is newer are skipped. Stop it with Ctrl+C or SIGTERM: the"
+	print "        conversions in progress are finished"
 	print "    -o, --output=DIR"
 	print "        Specify a directory name to generate kml, fdr files in"
 	print "Options:"
+	print "    --binary"
+	print "        Write the parsed data in the native binary format (.tofdr file), which is"
+	print "        read again without parsing (memory-mapped)"
+	print "    --cache-dir=DIR"
+	print "        Directory of the cache of parsed flights (default: ~/.cache/tofdr)"
+	print "    --cache-size=MB"
+	print "        Maximum size of the cache, least recently used flights are removed (default: 1024)"
+	print "    --clear-cache"
+	print "        Remove all the flights from the cache"
+	print "    --no-cache"
+	print "        Parse the input file without using or filling the cache"
 	print "    -d, --debug"
 	print "        Activate debug flag to create more data files for debugging"
+	print "    --fdr-distance=METERS"
+	print "        Only write a row of FDR data every METERS of the path (and the last one)"
 	print "    -h, --help"
 	print "        Print this message"
+	print "    -j, --jobs=N"
+	print "        Number of flights converted in parallel in batch and watch modes (default:"
+	print "        number of CPUs)"
+	print "    --incremental"
+	print "        Only convert the lines appended to the input file since the previous"
+	print "        conversion (to follow a flight still being logged), the state of the"
+	print "        conversion is saved in the .state file of DIR. With --watch, the files are"
+	print "        converted each time they grow"
 	print "    --info"
 	print "        Print information about flight collected from input file"
+	print "    --info-only"
+	print "        Only print information about flight (or each flight of the batch)"
+	print "        without conversion, DIR is not needed"
+	print "    --summary-format=FORMAT"
+	print "        Format of the information printed by --info-only: text (default), json"
+	print "        (one object by flight) or csv (one row by flight)"
+	print "    --kml-tolerance=METERS"
+	print "        Decimate the path written in the KML file (Douglas-Peucker): the path"
+	print "        keeps within METERS of the original one"
+	print "    --kml-track"
+	print "        Write the path as a gx:Track with the time of each point (KML 2.2)"
 	print "    -p, --plot"
 	print "        Generate different figures representing principal parameters"
+	print "    --plot-pdf"
+	print "        Generate the figures as the pages of a single pdf file"
+	print "    --poll-interval=SECONDS"
+	print "        Interval between two scans of the inbox in watch mode (default: 2), a file"
+	print "        is complete when its size did not change during an interval"
+	print "    --reader=NAME"
+	print "        Input reader to use instead of the one of the extension of the input file:"
+	print "        " + ", ".join(reader.name for reader in input_readers)
+	print "    -r, --rate=HZ"
+	print "        Resample the FDR data on a uniform time grid of HZ rows per second"
+	print "        (interpolated from the times of the input file)"
 	print "    -s, --smooth=VAL, --sigma=VAL"
 	print "        Specify the sigma value used for the gaussian filter to smooth"
+	print "    --split"
+	print "        Convert each flight of a log holding several flights in its own directory"
+	print "        DIR/DIR_N (in parallel). Flights are found from the ground speed, the"
+	print "        altitude changes, the gaps of the log and the phase column when present"
+	print "    --split-gap=SECONDS"
+	print "        Minimum time without rows between two flights with --split (default: 300)"
+	print "    --ground-speed=KNOTS"
+	print "        Ground speed under which the aircraft is on the ground when its altitude"
+	print "        is steady with --split (default: 30)"
+	print "    --stats"
+	print "        Print the wall time, CPU time, rows in and out and peak memory of each"
+	print "        stage of the conversion"
+	print "    --stats-json"
+	print "        Write the statistics of the stages to the _stats.json file in DIR"
+	print "    --profile"
+	print "        Run the conversion under cProfile and write the profile to the .prof file"
+	print "        in DIR (read it with python -m pstats)"
+	print "    --stream"
+	print "        Read, transform and write data by chunks to use a bounded memory"
+	print "        whatever the length of the flight (figures are not available)"
 	print "    --start-time=TIME"
 	print "        Specify the start time of the flight (truncated data before this time)."
 	print "         Time is specified as day/month/year_hour:minute:second"
@@ -475,99 +2090,499 @@ def usage(fix_param):
 	print "        Specify the stop time of the flight (truncated data after this time)."
 	print "	       Time is specified as day/month/year_hour:minute:second"
 	print "    --window=SIZE"
-	print "        Specify the window size to determine the mobile average applied to data."
+	print "        Specify the window size (number of rows) of the moving average applied to"
+	print "        data instead of the gaussian filter"
 	fix_param.usage()
 
-def main(argv):
-	global time_factor
+def convert(input_file, output, options):
+	created = not os.path.isdir(output)
+	if created:
+		os.makedirs(output)
+
+	stats = PipelineStats() if (options.stats or options.stats_json) else None
+	try:
+		if options.profile:
+			import cProfile
+			profiler = cProfile.Profile()
+			profiler.runcall(convert_flight, input_file, output, options, stats)
+			profiler.dump_stats(output_filename(output, '', '.prof'))
+		else:
+			convert_flight(input_file, output, options, stats)
+	except Exception:
+		if created: # No partial output left for a failed conversion
+			shutil.rmtree(output, ignore_errors=True)
+		raise
+	if options.stats:
+		stats.print_summary(input_file)
+	if options.stats_json:
+		stats.write_json(output_filename(output, '', '_stats.json'), input_file)
+
+def convert_flight(input_file, output, options, stats=None):
+	if options.incremental:
+		convert_incremental(input_file, output, options, stats)
+		return
+	if options.stream:
+		if options.plotting:
+			eprint("Warning: figures are not generated in stream mode !")
+		if options.split:
+			eprint("Warning: flights are not split in stream mode !")
+		convert_stream(input_file, output, options, stats)
+		return
+	if options.split:
+		convert_segments(input_file, output, options, stats)
+		return
+	convert_parsed(Pipeline(options, stats).parse(input_file), output, options, stats)
+
+def convert_parsed(flight, output, options, stats=None):
+	if options.plotting:
+		plotter = run_stage(stats, 'plot', FigurePlotter, output_filename(output, 'plot_', '.pdf') if options.plot_pdf else None)
+
+	default_format = 'Time;Lon;Lat;Alt;Roll;Pitch;Yaw'
+	pipeline = Pipeline(options, stats)
+	# Raw data
+	if options.debug:
+		run_stage(stats, 'debug csv', write_french_csv, flight.data, default_format, output_filename(output, '', '_raw.csv'))
+	if options.binary:
+		pipeline.binary(flight, output_filename(output, '', '.tofdr'))
 
+	# fix data
+	pipeline.fix(flight)
+	if options.debug:
+		run_stage(stats, 'debug csv', write_french_csv, flight.data, default_format, output_filename(output, '', '_fixed.csv'))
+
+	# Smooth data
+	pipeline.smooth(flight)
+	if options.debug:
+		run_stage(stats, 'debug csv', write_french_csv, flight.data, default_format, output_filename(output, '', '_smooth.csv'))
+	if options.plotting:
+		run_stage(stats, 'plot', lambda data: plotter.plot(prepare_figures(data, default_format, 'r', output, '_smooth')), flight.data)
+
+	# Export data to KML format
+	pipeline.kml(flight, output_filename(output, '', '.kml'))
+
+	# Resample data on a uniform time grid
+	if options.rate > 0:
+		pipeline.resample(flight)
+		if options.debug:
+			run_stage(stats, 'debug csv', write_french_csv, flight.data, default_format, output_filename(output, '', '_resampled.csv'))
+
+	# Transform to FDR format (create new data, like speed, from existing ones)
+	pipeline.derive(flight)
+	if options.debug:
+		run_stage(stats, 'debug csv', write_french_csv, flight.fdr_data, fdr_format, output_filename(output, '', '_fdr.csv'))
+	if options.plotting:
+		run_stage(stats, 'plot', lambda data: plotter.plot(prepare_figures(data, fdr_format, 'royalblue', output, '_fdr')), flight.fdr_data)
+
+	# Keep one row of FDR data every fdr_distance meters of the path
+	pipeline.decimate(flight)
+
+	# Write FDR data to file an export it to csv to verify what as been really written
+	written_data = pipeline.fdr(flight, output_filename(output, '', '.fdr'))
+	if options.debug:
+		run_stage(stats, 'debug csv', write_french_csv, written_data, 'TIME;LONG;LAT;ALT;AILDEFL;ELEVDEFL;PITCH;ROLL;HEADING;SPEED', output_filename(output, '', '_written.csv'))
+
+	if options.plotting:
+		run_stage(stats, 'plot', plotter.close)
+
+	# Print information about flight
+	if options.info:
+		print_flight_info(flight.fdr_data, flight.flight_feature)
+
+def convert_segment(args):
+	(flight, output, options) = args
+	if not os.path.isdir(output):
+		os.makedirs(output)
+	convert_parsed(flight, output, options)
+
+def convert_segments(input_file, output, options, stats=None):
+	# The log is parsed once and each of its flights is converted in its own directory DIR/DIR_N, in
+	# parallel (the figures of each flight are then drawn by its worker)
+	data, phases, flight_feature = run_stage(stats, 'parse', load_segmented_flight, input_file, options)
+	if len(data) == 0:
+		raise ValueError("no valid data found in " + input_name(input_file))
+	segments = run_stage(stats, 'split', flight_segments, data, phases, options.split_gap, options.ground_speed)
+	if not segments:
+		eprint("Warning: no flight found in " + input_name(input_file) + ", the whole log is converted")
+		segments = [(0, len(data))]
+	time_offset = flight_time_offset(flight_feature, data[0, 0])
+	name = os.path.basename(os.path.normpath(output))
+	tasks = []
+	print "%d flight(s) in %s:" % (len(segments), input_name(input_file))
+	for index, (start, stop) in enumerate(segments):
+		ff = FlightFeature()
+		ff.__dict__.update(flight_feature.__dict__)
+		ff.date, ff.time = epoch_date_time(data[start, 0], time_offset)
+		segment_output = os.path.join(output, name + '_' + str(index + 1))
+		print "    %s UTC %s (%.1f min) -> %s" % (ff.date, ff.time, (data[stop - 1, 0] - data[start, 0]) / time_factor / 60.0, segment_output)
+		# Rows copied as the stages work in place
+		tasks.append((Flight(np.asfortranarray(data[start:stop]), ff), segment_output, options))
+	del data
+	# Batch workers are daemon processes which can't have their own workers
+	if (len(tasks) > 1) and (multiprocessing.cpu_count() > 1) and not multiprocessing.current_process().daemon:
+		pool = multiprocessing.Pool(min(len(tasks), multiprocessing.cpu_count()))
+		run_stage(stats, 'flights', pool.map, convert_segment, tasks, 1)
+		pool.close()
+		pool.join()
+	else:
+		run_stage(stats, 'flights', map, convert_segment, tasks)
+
+#####
+# Batch conversion of several flights
+def is_input_file(filename):
+	return any(input_extension(filename) in reader.extensions for reader in input_readers)
+
+def find_batch_files(source):
+	if os.path.isdir(source): # All csv files of the directory
+		return sorted(input_file for input_file in glob.glob(os.path.join(source, '*')) if os.path.isfile(input_file) and is_input_file(input_file))
+	if os.path.isfile(source) and is_input_file(source): # A single input file
+		return [source]
+	if os.path.isfile(source): # Manifest: one csv file by line (relative to the manifest directory)
+		with open(source, 'rb') as manifest:
+			lines = [line.strip() for line in manifest]
+		input_files = []
+		for line in lines:
+			if line and not line.startswith('#'):
+				input_file = os.path.join(os.path.dirname(source), line)
+				if os.path.isfile(input_file):
+					input_files.append(input_file)
+				else:
+					eprint("Warning: " + input_file + " of the manifest " + source + " not found, skipped")
+		return input_files
+	return sorted(glob.glob(source)) # Glob pattern
+
+def flight_name(input_file):
+	# Name of the input file without its extension (and compression extension)
+	name = os.path.basename(input_file)
+	if os.path.splitext(name)[1].lower() in compressed_files:
+		name = os.path.splitext(name)[0]
+	return os.path.splitext(name)[0]
+
+def batch_output_dirs(input_files, output):
+	# Each flight is generated in its own directory named from the input file
+	output_dirs = []
+	for input_file in input_files:
+		name = flight_name(input_file)
+		output_dir = os.path.join(output, name)
+		index = 1
+		while output_dir in output_dirs:
+			index += 1
+			output_dir = os.path.join(output, name + '_' + str(index))
+		output_dirs.append(output_dir)
+	return output_dirs
+
+def convert_batch_file(args):
+	(input_file, output, options) = args
+	start = time.time()
+	try:
+		convert(input_file, output, options)
+	except Exception as e:
+		eprint("Error: conversion of " + input_file + " failed\n" + traceback.format_exc())
+		return input_file, output, e.__class__.__name__ + ': ' + str(e), time.time() - start
+	return input_file, output, None, time.time() - start
+
+def batch_result(input_file, output_dir, error, duration):
+	if error is None:
+		return "    OK      %s -> %s (%.1f s)" % (input_file, output_dir, duration)
+	return "    FAILED  %s (%s)" % (input_file, error)
+
+def convert_batch(source, output, jobs, options):
+	input_files = find_batch_files(source)
+	if not input_files:
+		eprint("Error: no input file found in " + source)
+		return 1
+	if not os.path.isdir(output):
+		os.makedirs(output)
+
+	tasks = [(input_file, output_dir, options) for input_file, output_dir in zip(input_files, batch_output_dirs(input_files, output))]
+	if jobs == 1:
+		results = map(convert_batch_file, tasks)
+	else:
+		pool = multiprocessing.Pool(jobs)
+		results = pool.map(convert_batch_file, tasks, 1)
+		pool.close()
+		pool.join()
+
+	failures = [result for result in results if result[2] is not None]
+	print "Batch summary: %d file(s), %d converted, %d failed" % (len(results), len(results) - len(failures), len(failures))
+	for result in results:
+		print batch_result(*result)
+	return 1 if failures else 0
+
+#####
+# Daemon: the files of an inbox directory are converted as soon as they are complete, by a pool of
+# workers started once. Without a portable file notification API, the inbox is polled: a file is
+# complete when its size and modification time did not change since the previous poll.
+class InboxWatcher:
+	# growing files are converted at each change instead of once complete (incremental mode)
+	def __init__(self, inbox, growing=False):
+		self.inbox = inbox
+		self.growing = growing
+		self.states = {} # (size, modification time) of each file at the previous poll
+		self.done = {} # State of each file converted (or failed), skipped until it changes
+
+	def poll(self):
+		# Files complete and not converted yet, with their state
+		ready = []
+		states = {}
+		for input_file in find_batch_files(self.inbox):
+			if os.path.basename(input_file).startswith('.'): # Hidden files of the synchronization tools
+				continue
+			try:
+				stat = os.stat(input_file)
+			except OSError: # Removed since listed
+				continue
+			state = (stat.st_size, stat.st_mtime)
+			states[input_file] = state
+			if (self.growing or (self.states.get(input_file) == state)) and (self.done.get(input_file) != state):
+				ready.append((input_file, state))
+		self.states = states
+		return ready
+
+def output_up_to_date(input_file, output_dir):
+	fdr_file = output_filename(output_dir, '', '.fdr')
+	return os.path.isfile(fdr_file) and (os.path.getmtime(fdr_file) >= os.path.getmtime(input_file))
+
+def init_watch_worker():
+	# Interruptions are handled by the daemon, which waits for the conversions in progress
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+def watch_log(message):
+	print time.strftime('%Y-%m-%d %H:%M:%S') + message
+	sys.stdout.flush()
+
+def watch_inbox(inbox, output, jobs, options, interval):
+	if not os.path.isdir(inbox):
+		eprint("Error: " + inbox + " is not a directory")
+		return 1
+	if not os.path.isdir(output):
+		os.makedirs(output)
+	stop_signals = []
+	for signum in (signal.SIGINT, signal.SIGTERM):
+		signal.signal(signum, lambda signum, frame: stop_signals.append(signum))
+
+	pool = multiprocessing.Pool(jobs, init_watch_worker)
+	watcher = InboxWatcher(inbox, options.incremental)
+	queue = {} # State and result of each file being converted
+	queue_size = 2 * jobs # Files ready beyond it wait for the next polls (back-pressure)
+	nb_failures = 0
+	watch_log(" Watching %s (every %g s, %d worker(s)), stop with Ctrl+C or SIGTERM" % (inbox, interval, jobs))
+	while not stop_signals:
+		for input_file, (state, result) in queue.items():
+			if result.ready():
+				del queue[input_file]
+				watcher.done[input_file] = state
+				conversion = result.get()
+				nb_failures += conversion[2] is not None
+				watch_log(batch_result(*conversion))
+		for input_file, state in watcher.poll():
+			if (input_file in queue) or (len(queue) >= queue_size):
+				continue
+			output_dir = os.path.join(output, flight_name(input_file))
+			if output_up_to_date(input_file, output_dir):
+				watcher.done[input_file] = state
+				continue
+			queue[input_file] = (state, pool.apply_async(convert_batch_file, ((input_file, output_dir, options),)))
+		time.sleep(interval) # Interrupted by the stop signals
+
+	watch_log(" Stopping: waiting for %d conversion(s) in progress" % len(queue))
+	pool.close()
+	pool.join()
+	for input_file, (state, result) in queue.items():
+		conversion = result.get()
+		nb_failures += conversion[2] is not None
+		watch_log(batch_result(*conversion))
+	return 1 if nb_failures else 0
+
+#####
+# Summaries of flights without conversion: only the time, lon and lat columns are parsed
+summary_fields = ['file', 'date', 'time', 'aircraft', 'registration', 'pilot', 'location', 'rows', 'duration_s', 'distance_km']
+
+def load_flight_track(input_file, options):
+	if use_cache(input_file, options): # Flight already parsed by a conversion
+		cached = find_cached_flight(input_file, options)
+		if cached is not None:
+			(data, ff, time_offset, sorted_times) = cached
+			rows, ff = cached_window(data, ff, time_offset, sorted_times, options.start_time, options.stop_time)
+			# Copied (not a view of the memory-mapped data) as the summary smooths it in place
+			output = np.empty((len(rows), len(info_fields)), order='F')
+			np.take(data[:, :len(info_fields)], rows, axis=0, out=output)
+			return output, ff
+	ff = FlightFeature()
+	# All the fields are read so that the rows with a NaN value are dropped as in the cache (same rows count)
+	chunks = [data[:, :len(info_fields)] for data in read_input_chunks(input_file, options.start_time, options.stop_time, ff, fields_dest, options.reader)]
+	data = np.empty((sum(len(data) for data in chunks), len(info_fields)), order='F')
+	if chunks:
+		np.concatenate(chunks, out=data)
+	return data, ff
+
+def flight_summary(input_file, options):
+	# Same distance and duration as --info after a conversion (with the same smoothing)
+	data, ff = load_flight_track(input_file, options)
+	if len(data) == 0:
+		raise ValueError("no valid data found in " + input_file)
+	smooth_columns(data, *column_filters(range(len(info_fields)), options.sigma, options.window))
+	path_length = get_path_length(data)[0]
+	flight_time = data[-1, 0] - data[0, 0]
+	row = [input_file, ff.date, ff.time, getattr(ff, 'aircraft', ''), ff.registration, ff.pilot, ff.location, len(data), flight_time / time_factor, path_length / 1000.0]
+	return ff, collections.OrderedDict(zip(summary_fields, row))
+
+def flight_summary_file(args):
+	(input_file, options) = args
+	try:
+		return flight_summary(input_file, options) + (None,)
+	except Exception as e:
+		return None, None, e.__class__.__name__ + ': ' + str(e)
+
+def print_summaries(input_files, jobs, options):
+	if options.summary_format == 'csv':
+		writer = csv.writer(sys.stdout)
+		writer.writerow(summary_fields)
+	tasks = [(input_file, options) for input_file in input_files]
+	if jobs == 1:
+		results = itertools.imap(flight_summary_file, tasks)
+	else:
+		pool = multiprocessing.Pool(jobs)
+		results = pool.imap(flight_summary_file, tasks, 4)
+	nb_failures = 0
+	for input_file, (ff, summary, error) in itertools.izip(input_files, results):
+		if error is not None:
+			eprint("Error: summary of " + input_file + " failed (" + error + ")")
+			nb_failures += 1
+		elif options.summary_format == 'json':
+			print json.dumps(summary)
+		elif options.summary_format == 'csv':
+			writer.writerow(summary.values())
+		else:
+			if len(input_files) > 1:
+				print '==> ' + input_file
+			print_flight_summary(ff, summary['distance_km'] * 1000.0, summary['duration_s'] * time_factor)
+		sys.stdout.flush()
+	if jobs != 1:
+		pool.close()
+		pool.join()
+	return 1 if nb_failures else 0
+
+#####
+# Main Program
+def main(argv):
 	# Initialize parameters values
-	debug = False
-	info = False
 	input_file = ""
 	output = ""
-	plotting = False
-	sigma = 0
-	window = 0
-	start_time = 0
-	stop_time = time.mktime(time.localtime()) * time_factor
-	fix_param = FixData()
+	batch = ""
+	watch = ""
+	poll_interval = 2.0
+	jobs = multiprocessing.cpu_count()
+	clear = False
+	options = ConvertOptions()
 	try:
-		opts, args = getopt.getopt(argv, "hdi:o:ps:w:", ["help", "debug", "input=", "output=", "plot", "smooth=", "sigma=", "window=", "fix-airport-elevation=", "fix-elevation=", "fix-pitch=", "fix-roll=", "fix-yaw=", "info", "start-time=", "stop-time="])
+		opts, args = getopt.getopt(argv, "hb:dj:i:o:pr:s:w:", ["help", "batch=", "debug", "jobs=", "input=", "output=", "plot", "plot-pdf", "rate=", "fdr-distance=", "smooth=", "sigma=", "window=", "fix-airport-elevation=", "fix-elevation=", "fix-pitch=", "fix-roll=", "fix-yaw=", "info", "cache-dir=", "cache-size=", "clear-cache", "no-cache", "kml-tolerance=", "kml-track", "start-time=", "stop-time=", "stream", "stats", "stats-json", "profile", "info-only", "summary-format=", "reader=", "binary", "watch=", "poll-interval=", "incremental", "split", "split-gap=", "ground-speed="])
 	except getopt.GetoptError:
 		print sys.argv[0] + ": invalid option"
-		usage(fix_param)
+		usage(options.fix_param)
 		sys.exit(2)
 	for opt, arg in opts:
 		if opt in ("-h", "--help"):
-			usage(fix_param)
+			usage(options.fix_param)
 			sys.exit()
+		elif opt in ("-b", "--batch"):
+			batch = arg
 		elif opt in ("-d", "--debug"):
-			debug = True
+			options.debug = True
+		elif opt in ("-j", "--jobs"):
+			jobs = max(int(arg), 1)
 		elif opt in ("-i", "--input"):
 			input_file = arg
 		elif opt in ("-o", "--output"):
 			output = arg
 		elif opt in ("-p", "--plot"):
-			plotting = True
+			options.plotting = True
+		elif opt in ("--plot-pdf"):
+			options.plotting = True
+			options.plot_pdf = True
+		elif opt in ("-r", "--rate"):
+			options.rate = float(arg)
+		elif opt in ("--fdr-distance"):
+			options.fdr_distance = float(arg)
 		elif opt in ("-s", "--smooth", "--sigma"):
-			sigma = float(arg)
+			options.sigma = float(arg)
 		elif opt in ("-w", "--window"):
-			eprint("Warning: window paramter is not yet implemented !")
-			window = int(arg)
+			options.window = int(arg)
 		elif opt.startswith("--fix-"):
-			fix_param.parse_opt(opt, arg)
+			options.fix_param.parse_opt(opt, arg)
 		elif opt in ("--info"):
-			info = True
+			options.info = True
+		elif opt in ("--info-only"):
+			options.info_only = True
+		elif opt in ("--reader"):
+			if arg not in [reader.name for reader in input_readers]:
+				print sys.argv[0] + ": unknown input reader " + arg
+				usage(options.fix_param)
+				sys.exit(2)
+			options.reader = arg
+		elif opt in ("--binary"):
+			options.binary = True
+		elif opt in ("--summary-format"):
+			if arg not in ('text', 'json', 'csv'):
+				print sys.argv[0] + ": invalid summary format " + arg
+				usage(options.fix_param)
+				sys.exit(2)
+			options.summary_format = arg
+		elif opt in ("--stream"):
+			options.stream = True
+		elif opt in ("--incremental"):
+			options.incremental = True
+		elif opt in ("--split"):
+			options.split = True
+		elif opt in ("--split-gap"):
+			options.split_gap = float(arg)
+		elif opt in ("--ground-speed"):
+			options.ground_speed = float(arg)
+		elif opt in ("--watch"):
+			watch = arg
+		elif opt in ("--poll-interval"):
+			poll_interval = max(float(arg), 0.1)
+		elif opt in ("--stats"):
+			options.stats = True
+		elif opt in ("--stats-json"):
+			options.stats_json = True
+		elif opt in ("--profile"):
+			options.profile = True
+		elif opt in ("--cache-dir"):
+			options.cache_dir = arg
+		elif opt in ("--cache-size"):
+			options.cache_size = float(arg)
+		elif opt in ("--clear-cache"):
+			clear = True
+		elif opt in ("--no-cache"):
+			options.cache = False
+		elif opt in ("--kml-tolerance"):
+			options.kml_tolerance = float(arg)
+		elif opt in ("--kml-track"):
+			options.kml_track = True
 		elif opt in ("--start-time"):
-			start_time = time.mktime(time.strptime(arg, "%d/%m/%Y_%H:%M:%S")) * time_factor
+			options.start_time = time.mktime(time.strptime(arg, "%d/%m/%Y_%H:%M:%S")) * time_factor
 		elif opt in ("--stop-time"):
-			stop_time = time.mktime(time.strptime(arg, "%d/%m/%Y_%H:%M:%S")) * time_factor
-
-	if (input_file == "") or (output == ""):
-		print sys.argv[0] + ": must specify arguments"
-		usage(fix_param)
-		sys.exit(1)
-	else:
-		if not os.path.isdir(output):
-			os.makedirs(output)
-
-	default_format = 'Time;Lon;Lat;Alt;Roll;Pitch;Yaw'
-	# Raw data
-	raw_data, flight_feature = format_and_filter_csv(input_file, start_time, stop_time, output_filename(output, '', '.csv'))
-	if debug:
-		write_french_csv(raw_data, default_format, output_filename(output, '', '_raw.csv'))
+			options.stop_time = time.mktime(time.strptime(arg, "%d/%m/%Y_%H:%M:%S")) * time_factor
 
-	# fix data
-	fixed_data = fix_raw_data(raw_data, fix_param)
-	if debug:
-		write_french_csv(fixed_data, default_format, output_filename(output, '', '_fixed.csv'))
-
-	# Smooth data
-	smoothed_data = smooth_data(fixed_data, sigma)
-	if debug:
-		write_french_csv(smoothed_data, default_format, output_filename(output, '', '_smooth.csv'))
-	if plotting:
-		plot_figures(smoothed_data, default_format, 'r', output, '_smooth')
+	if clear:
+		clear_cache(options.cache_dir)
+		if (input_file == "") and (batch == ""):
+			sys.exit()
 
-	# Export data to KML format
-	write_kml(smoothed_data, output_filename(output, '', '.kml'))
+	if options.info_only and ((input_file != "") or (batch != "")):
+		sys.exit(print_summaries([input_file] if input_file != "" else find_batch_files(batch), jobs if batch != "" else 1, options))
 
-	# Transform to FDR format (create new data, like speed, from existing ones)
-	fdr_data = to_fdr(smoothed_data, sigma)
-	if debug:
-		write_french_csv(fdr_data, 'Time;Lon;Lat;Alt;Speed;Bearing;Pitch;Roll', output_filename(output, '', '_fdr.csv'))
-	if plotting:
-		plot_figures(fdr_data, 'Time;Lon;Lat;Alt;Speed;Bearing;Pitch;Roll', 'royalblue', output, '_fdr')
-
-	# Write FDR data to file an export it to csv to verify what as been really written
-	written_data = write_fdr(fdr_data, flight_feature, output_filename(output, '', '.fdr'))
-	if debug:
-		write_french_csv(written_data, 'TIME;LONG;LAT;ALT;AILDEFL;ELEVDEFL;PITCH;ROLL;HEADING;SPEED', output_filename(output, '', '_written.csv'))
+	if ((input_file == "") and (batch == "") and (watch == "")) or (output == ""):
+		print sys.argv[0] + ": must specify arguments"
+		usage(options.fix_param)
+		sys.exit(1)
 
-	# Print information about flight
-	if info:
-		print_flight_info(fdr_data, flight_feature)
+	if watch != "":
+		sys.exit(watch_inbox(watch, output, jobs, options, poll_interval))
+	if batch != "":
+		sys.exit(convert_batch(batch, output, jobs, options))
+	convert(input_file, output, options)
 
 if __name__ == "__main__":
-	main(sys.argv[1:])
\ No newline at end of file
+	main(sys.argv[1:])